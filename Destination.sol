@@ -23,6 +23,18 @@ contract Destination is AccessControl {
     }
 
 	function wrap(address _underlying_token, address _recipient, uint256 _amount ) public onlyRole(WARDEN_ROLE) {
+		_wrap(_underlying_token, _recipient, _amount);
+	}
+
+	function batchWrap(address[] calldata _underlying_tokens, address[] calldata _recipients, uint256[] calldata _amounts ) public onlyRole(WARDEN_ROLE) {
+		// One entry per Deposit being relayed, so the warden pays the transaction overhead once
+		require(_underlying_tokens.length == _recipients.length && _recipients.length == _amounts.length, "Length mismatch");
+		for( uint256 i = 0; i < _underlying_tokens.length; i++ ) {
+			_wrap(_underlying_tokens[i], _recipients[i], _amounts[i]);
+		}
+	}
+
+	function _wrap(address _underlying_token, address _recipient, uint256 _amount ) internal {
 		// Check that the underlying asset has been registered
 		require(wrapped_tokens[_underlying_token] != address(0), "Token not registered");
 		
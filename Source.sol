@@ -34,6 +34,18 @@ contract Source is AccessControl {
 
 	function withdraw(address _token, address _recipient, uint256 _amount ) onlyRole(WARDEN_ROLE) public {
 		// Check that the function is being called by the contract owner (already handled by onlyRole(WARDEN_ROLE))
+		_withdraw(_token, _recipient, _amount);
+	}
+
+	function batchWithdraw(address[] calldata _tokens, address[] calldata _recipients, uint256[] calldata _amounts ) onlyRole(WARDEN_ROLE) public {
+		// One entry per Unwrap being relayed, so the warden pays the transaction overhead once
+		require(_tokens.length == _recipients.length && _recipients.length == _amounts.length, "Length mismatch");
+		for( uint256 i = 0; i < _tokens.length; i++ ) {
+			_withdraw(_tokens[i], _recipients[i], _amounts[i]);
+		}
+	}
+
+	function _withdraw(address _token, address _recipient, uint256 _amount ) internal {
 		// Push the tokens to the recipient using the ERC20 "transfer" function
 		ERC20(_token).transfer(_recipient, _amount);
 		
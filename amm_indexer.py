@@ -0,0 +1,175 @@
+import bisect
+import json
+
+from web3 import Web3
+
+from amm_quote import AMM_ABI, ERC20_BALANCE_ABI, Pool
+from head_tracker import block_number
+
+
+AMM_EVENTS_ABI = json.loads('[ { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "_inToken", "type": "address" }, { "indexed": true, "internalType": "address", "name": "_outToken", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "inAmt", "type": "uint256" }, { "indexed": false, "internalType": "uint256", "name": "outAmt", "type": "uint256" } ], "name": "Swap", "type": "event" }, { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "_from", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "AQty", "type": "uint256" }, { "indexed": false, "internalType": "uint256", "name": "BQty", "type": "uint256" } ], "name": "LiquidityProvision", "type": "event" }, { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "_from", "type": "address" }, { "indexed": true, "internalType": "address", "name": "recipient", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "AQty", "type": "uint256" }, { "indexed": false, "internalType": "uint256", "name": "BQty", "type": "uint256" } ], "name": "Withdrawal", "type": "event" } ]')
+
+EVENT_SIGNATURES = {
+    'Swap': 'Swap(address,address,uint256,uint256)',
+    'LiquidityProvision': 'LiquidityProvision(address,uint256,uint256)',
+    'Withdrawal': 'Withdrawal(address,address,uint256,uint256)',
+}
+
+
+class AMMIndexer:
+    """
+        Rebuilds an AMM.sol pool's tokenA/tokenB reserves from its events alone
+
+        Each Swap/LiquidityProvision/Withdrawal log is turned into a reserve delta,
+        so no balanceOf call is needed per block. Every `snapshot_interval` blocks
+        the running reserves are snapshotted, and state_at(block) replays only the
+        deltas after the nearest snapshot.
+
+        The reserves start from the pool's token balances at start_block - 1 (two
+        balanceOf calls, which for an old start_block need an archive node), so
+        indexing can start after the pool was funded.
+
+        Only changes made through the contract are seen: tokens transferred to the
+        AMM directly don't emit an event and won't show up in the reserves.
+    """
+
+    def __init__(self, w3, amm_address, start_block=0, snapshot_interval=1000, chunk_size=2000,
+                 token_a=None, token_b=None):
+        self.w3 = w3
+        self.amm_address = Web3.to_checksum_address(amm_address)
+        self.contract = w3.eth.contract(address=self.amm_address, abi=AMM_ABI + AMM_EVENTS_ABI)
+        # Checksummed, to compare with the addresses in decoded events
+        self.token_a = Web3.to_checksum_address(token_a or self.contract.functions.tokenA().call())
+        self.token_b = Web3.to_checksum_address(token_b or self.contract.functions.tokenB().call())
+        self.snapshot_interval = snapshot_interval
+        self.chunk_size = chunk_size
+        self.topics = {Web3.keccak(text=signature): name for name, signature in EVENT_SIGNATURES.items()}
+
+        # deltas[i] = (block, log_index, delta_a, delta_b), in chain order
+        self.deltas = []
+        self._delta_keys = []
+        # snapshots[i] = (block, reserve_a, reserve_b, number of deltas applied)
+        self.reserve_a, self.reserve_b = self._balances_at(start_block - 1)
+        self.snapshots = [(start_block - 1, self.reserve_a, self.reserve_b, 0)]
+        self.last_block = start_block - 1
+
+    def _balances_at(self, block):
+        # Nothing can be in the pool before the first block
+        if block < 0:
+            return 0, 0
+        return tuple(
+            self.w3.eth.contract(address=token, abi=ERC20_BALANCE_ABI).functions.balanceOf(self.amm_address).call(block_identifier=block)
+            for token in (self.token_a, self.token_b)
+        )
+
+    @property
+    def invariant(self):
+        # The contract recomputes the invariant as balanceA * balanceB after every operation
+        return self.reserve_a * self.reserve_b
+
+    def _delta(self, name, args):
+        if name == 'Swap':
+            if args['_inToken'] == self.token_a:
+                return args['inAmt'], -args['outAmt']
+            return -args['outAmt'], args['inAmt']
+        if name == 'LiquidityProvision':
+            return args['AQty'], args['BQty']
+        return -args['AQty'], -args['BQty']
+
+    def sync(self, to_block='latest'):
+        """
+            Fetches and applies every event after the last indexed block, in chunks
+            Returns the number of events applied
+        """
+        if to_block == 'latest':
+            to_block = block_number(self.w3)
+        applied = 0
+        while self.last_block < to_block:
+            start_block = self.last_block + 1
+            end_block = min(to_block, start_block + self.chunk_size - 1)
+            logs = self.w3.eth.get_logs({
+                'address': self.amm_address,
+                'fromBlock': start_block,
+                'toBlock': end_block,
+                'topics': [list(self.topics)],
+            })
+            applied += self.apply_logs(logs, end_block)
+        return applied
+
+    def apply_logs(self, logs, end_block):
+        """
+            Applies raw logs covering up to end_block (e.g. from a subscription)
+            and snapshots at every snapshot_interval boundary they cross
+        """
+        logs = sorted(logs, key=lambda log: (log['blockNumber'], log['logIndex']))
+        for log in logs:
+            self._snapshot_through(log['blockNumber'] - 1)
+            name = self.topics[bytes(log['topics'][0])]
+            event = getattr(self.contract.events, name)().process_log(log)
+            delta_a, delta_b = self._delta(name, event['args'])
+            self.reserve_a += delta_a
+            self.reserve_b += delta_b
+            self.deltas.append((log['blockNumber'], log['logIndex'], delta_a, delta_b))
+            self._delta_keys.append((log['blockNumber'], log['logIndex']))
+        self._snapshot_through(end_block)
+        self.last_block = max(self.last_block, end_block)
+        return len(logs)
+
+    def _snapshot_through(self, block):
+        # Snapshot the state at the end of each interval boundary up to block
+        last_snapshot = self.snapshots[-1][0]
+        boundary = (last_snapshot // self.snapshot_interval + 1) * self.snapshot_interval
+        if boundary <= block:
+            self.snapshots.append((block, self.reserve_a, self.reserve_b, len(self.deltas)))
+
+    def state_at(self, block):
+        """
+            Returns a Pool with the reserves at the end of `block`
+            Replays the deltas after the nearest snapshot at or before that block
+        """
+        if block > self.last_block:
+            raise ValueError(f"Block {block} is after the last indexed block {self.last_block}")
+        i = bisect.bisect_right(self.snapshots, (block, float('inf'))) - 1
+        snapshot_block, reserve_a, reserve_b, first_delta = self.snapshots[max(i, 0)]
+        last_delta = bisect.bisect_right(self._delta_keys, (block, float('inf')))
+        for _, _, delta_a, delta_b in self.deltas[first_delta:last_delta]:
+            reserve_a += delta_a
+            reserve_b += delta_b
+        return Pool(self.token_a, self.token_b, reserve_a, reserve_b)
+
+    def series(self):
+        """
+            Yields (block, log_index, reserve_a, reserve_b, invariant) after every event
+        """
+        _, reserve_a, reserve_b, _ = self.snapshots[0]
+        for block, log_index, delta_a, delta_b in self.deltas:
+            reserve_a += delta_a
+            reserve_b += delta_b
+            yield block, log_index, reserve_a, reserve_b, reserve_a * reserve_b
+
+    def save(self, filename):
+        """
+            Writes the indexed deltas and snapshots so a later run can resume with load()
+        """
+        with open(filename, 'w') as f:
+            json.dump({
+                'amm_address': self.amm_address,
+                'token_a': self.token_a,
+                'token_b': self.token_b,
+                'last_block': self.last_block,
+                'deltas': self.deltas,
+                'snapshots': self.snapshots,
+            }, f)
+
+    @classmethod
+    def load(cls, w3, filename, **kwargs):
+        with open(filename, 'r') as f:
+            d = json.load(f)
+        indexer = cls(w3, d['amm_address'], token_a=d['token_a'], token_b=d['token_b'], **kwargs)
+        indexer.deltas = [tuple(delta) for delta in d['deltas']]
+        indexer._delta_keys = [(block, log_index) for block, log_index, _, _ in indexer.deltas]
+        indexer.snapshots = [tuple(snapshot) for snapshot in d['snapshots']]
+        indexer.last_block = d['last_block']
+        indexer.reserve_a = indexer.snapshots[0][1] + sum(delta[2] for delta in indexer.deltas)
+        indexer.reserve_b = indexer.snapshots[0][2] + sum(delta[3] for delta in indexer.deltas)
+        return indexer
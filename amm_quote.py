@@ -0,0 +1,198 @@
+import json
+import math
+
+import numpy as np
+
+
+# Same fee as AMM.sol: feebps / 10000 of the sell amount stays in the pool
+FEE_BPS = 3
+
+AMM_ABI = json.loads('[ { "inputs": [], "name": "tokenA", "outputs": [ { "internalType": "address", "name": "", "type": "address" } ], "stateMutability": "view", "type": "function" }, { "inputs": [], "name": "tokenB", "outputs": [ { "internalType": "address", "name": "", "type": "address" } ], "stateMutability": "view", "type": "function" }, { "inputs": [], "name": "invariant", "outputs": [ { "internalType": "uint256", "name": "", "type": "uint256" } ], "stateMutability": "view", "type": "function" } ]')
+ERC20_BALANCE_ABI = json.loads('[ { "inputs": [ { "internalType": "address", "name": "account", "type": "address" } ], "name": "balanceOf", "outputs": [ { "internalType": "uint256", "name": "", "type": "uint256" } ], "stateMutability": "view", "type": "function" } ]')
+
+# Largest product that still fits in an int64, for the NumPy fast path
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def swap_output(reserve_in, reserve_out, sell_amount, feebps=FEE_BPS):
+    """
+        Output of AMM.tradeTokens for selling sell_amount against the given balances
+        Same integer math as the contract:
+            fee = sellAmount * feebps / 10000
+            swapAmt = balanceOut * (sellAmount - fee) / (balanceIn + sellAmount - fee)
+    """
+    fee = (sell_amount * feebps) // 10000
+    after_fee = sell_amount - fee
+    return (reserve_out * after_fee) // (reserve_in + after_fee)
+
+
+def swap_outputs(reserve_in, reserve_out, sell_amounts, feebps=FEE_BPS, exact=True):
+    """
+        Vectorized swap_output for many candidate sell amounts at once
+        exact=True matches the contract to the unit: int64 arithmetic when every
+        intermediate product fits (small test pools), exact Python integers
+        (object arrays) otherwise. Realistic 18-decimal reserves (~1e21) always
+        take the object path, which is no faster than looping over swap_output
+        exact=False computes in float64 instead: fast at any size, and off from
+        the exact output by a unit or two plus about 1e-15 of it, which is fine
+        for estimates such as price impact
+    """
+    if not exact:
+        amounts = np.asarray(sell_amounts, dtype=np.float64)
+        after_fee = amounts - np.floor(amounts * feebps / 10000)
+        return np.floor(float(reserve_out) * after_fee / (float(reserve_in) + after_fee))
+    amounts = np.asarray(sell_amounts)
+    largest = int(amounts.max()) if amounts.size else 0
+    if largest * max(feebps, 1) <= _INT64_MAX and reserve_out * largest <= _INT64_MAX \
+            and reserve_in + largest <= _INT64_MAX:
+        amounts = amounts.astype(np.int64)
+    else:
+        amounts = amounts.astype(object)
+        reserve_in = int(reserve_in)
+        reserve_out = int(reserve_out)
+    after_fee = amounts - (amounts * feebps) // 10000
+    return (reserve_out * after_fee) // (reserve_in + after_fee)
+
+
+class Pool:
+    """
+        Offline copy of an AMM.sol pool's state
+        Reserves are the token balances of the contract; invariant is the stored
+        invariant the contract checks each trade against (tradeTokens reverts
+        with 'Bad trade' if the new balance product is below it)
+    """
+
+    def __init__(self, token_a, token_b, reserve_a, reserve_b, invariant=None, feebps=FEE_BPS):
+        self.token_a = token_a
+        self.token_b = token_b
+        self.reserve_a = reserve_a
+        self.reserve_b = reserve_b
+        self.invariant = reserve_a * reserve_b if invariant is None else invariant
+        self.feebps = feebps
+
+    @classmethod
+    def from_chain(cls, w3, amm_address, block_identifier='latest'):
+        """
+            Reads the pool's tokens, balances and invariant once, at one block
+        """
+        amm = w3.eth.contract(address=amm_address, abi=AMM_ABI)
+        token_a = amm.functions.tokenA().call(block_identifier=block_identifier)
+        token_b = amm.functions.tokenB().call(block_identifier=block_identifier)
+        invariant = amm.functions.invariant().call(block_identifier=block_identifier)
+        reserves = [
+            w3.eth.contract(address=token, abi=ERC20_BALANCE_ABI).functions.balanceOf(amm_address).call(block_identifier=block_identifier)
+            for token in (token_a, token_b)
+        ]
+        return cls(token_a, token_b, reserves[0], reserves[1], invariant)
+
+    def reserves(self, sell_token):
+        """
+            Returns (reserve_in, reserve_out) for selling sell_token
+        """
+        if sell_token == self.token_a:
+            return self.reserve_a, self.reserve_b
+        if sell_token == self.token_b:
+            return self.reserve_b, self.reserve_a
+        raise ValueError('Invalid token')
+
+    def quote(self, sell_token, sell_amount):
+        """
+            Amount of the other token tradeTokens(sell_token, sell_amount) pays out
+            Raises ValueError with the contract's revert message if the trade would revert
+        """
+        if self.invariant <= 0:
+            raise ValueError('Invariant must be nonzero')
+        reserve_in, reserve_out = self.reserves(sell_token)
+        if sell_amount <= 0:
+            raise ValueError('Cannot trade 0')
+        out = swap_output(reserve_in, reserve_out, sell_amount, self.feebps)
+        if (reserve_in + sell_amount) * (reserve_out - out) < self.invariant:
+            raise ValueError('Bad trade')
+        return out
+
+    def quote_many(self, sell_token, sell_amounts, exact=True):
+        """
+            quote() for an array of candidate sizes in one call (no revert checks)
+            exact=False gives float64 estimates, see swap_outputs
+        """
+        reserve_in, reserve_out = self.reserves(sell_token)
+        return swap_outputs(reserve_in, reserve_out, sell_amounts, self.feebps, exact)
+
+    def after_trade(self, sell_token, sell_amount):
+        """
+            The pool as it would be after the trade
+        """
+        out = self.quote(sell_token, sell_amount)
+        if sell_token == self.token_a:
+            reserve_a, reserve_b = self.reserve_a + sell_amount, self.reserve_b - out
+        else:
+            reserve_a, reserve_b = self.reserve_a - out, self.reserve_b + sell_amount
+        return Pool(self.token_a, self.token_b, reserve_a, reserve_b, reserve_a * reserve_b, self.feebps)
+
+    def spot_price(self, sell_token):
+        """
+            Units of the other token per unit of sell_token, before fees
+        """
+        reserve_in, reserve_out = self.reserves(sell_token)
+        return reserve_out / reserve_in
+
+    def price_impact(self, sell_token, sell_amounts):
+        """
+            1 - execution price / spot price, for one size or an array of sizes
+            (includes the fee, so even a tiny trade has an impact of about feebps/10000)
+        """
+        amounts = np.asarray(sell_amounts, dtype=float)
+        outs = self.quote_many(sell_token, amounts, exact=False)
+        return 1 - (outs / amounts) / self.spot_price(sell_token)
+
+    def amount_in_for(self, sell_token, amount_out):
+        """
+            Smallest sell amount that pays out at least amount_out (None if impossible)
+        """
+        reserve_in, reserve_out = self.reserves(sell_token)
+        if amount_out >= reserve_out:
+            return None
+        # Invert the formula ignoring rounding, then fix up with exact quotes
+        after_fee = -(-amount_out * reserve_in // (reserve_out - amount_out))
+        low = max(1, after_fee)
+        high = -(-after_fee * 10000 // (10000 - self.feebps)) + 2
+        while swap_output(reserve_in, reserve_out, high, self.feebps) < amount_out:
+            high *= 2
+        while low < high:
+            mid = (low + high) // 2
+            if swap_output(reserve_in, reserve_out, mid, self.feebps) >= amount_out:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def optimal_trade(self, sell_token, external_price):
+        """
+            Sell amount that maximises out - sell_amount * external_price, i.e. the
+            arbitrage against a market where sell_token is worth external_price
+            units of the other token. Returns (sell_amount, profit), (0, 0) if no trade pays
+        """
+        reserve_in, reserve_out = self.reserves(sell_token)
+        gamma = 1 - self.feebps / 10000
+        # d(out)/d(sell) = external_price  =>  reserve_in + gamma * sell = sqrt(reserve_in * reserve_out * gamma / price)
+        target = math.sqrt(reserve_in * reserve_out * gamma / external_price)
+        estimate = int((target - reserve_in) / gamma)
+        if estimate <= 0:
+            return 0, 0
+
+        # The closed form ignores integer rounding, so check the neighbourhood exactly
+        candidates = np.array([max(1, estimate + offset) for offset in range(-16, 17)], dtype=object)
+        profits = np.asarray(self.quote_many(sell_token, candidates), dtype=float) - candidates * external_price
+        best = int(np.argmax(profits))
+        if profits[best] <= 0:
+            return 0, 0
+        return int(candidates[best]), float(profits[best])
+
+
+if __name__ == '__main__':
+    pool = Pool('A', 'B', 10 ** 21, 2 * 10 ** 21)
+    print(f"Selling 1e18 A pays {pool.quote('A', 10 ** 18)} B")
+    sizes = [10 ** exponent for exponent in range(15, 22)]
+    for size, impact in zip(sizes, pool.price_impact('A', sizes)):
+        print(f"  size={size:.1e} impact={impact:.4%}")
+    print(f"Optimal A sale if A is worth 1.9 B elsewhere: {pool.optimal_trade('A', 1.9)}")
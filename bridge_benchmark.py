@@ -0,0 +1,320 @@
+#!/bin/python
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from web3 import Web3
+from web3.middleware import Web3Middleware
+from web3.providers.eth_tester import EthereumTesterProvider
+
+from bridge import bridge_loop, wait_for_receipts, send_transactions
+from signer import TestSigner
+
+
+# Compiled contracts the harness deploys; test ERC20s are plain BridgeTokens
+# deployed with the benchmark user as their admin, so it can mint them
+ARTIFACT_NAMES = ('Source', 'Destination', 'BridgeToken')
+
+# Gas for the user's deposit/unwrap transactions, so they skip eth_estimateGas
+USER_GAS = 300000
+
+
+def load_artifact(artifacts_dir, name):
+    """
+        Finds <name>.json under artifacts_dir and returns {'abi', 'bytecode'}
+        Works with forge (out/Name.sol/Name.json, bytecode.object) and
+        hardhat (artifacts/.../Name.json, bytecode string) output
+    """
+    matches = glob.glob(os.path.join(artifacts_dir, '**', f'{name}.json'), recursive=True)
+    if not matches:
+        raise FileNotFoundError(f"No {name}.json under {artifacts_dir}, compile the contracts first")
+    with open(matches[0], 'r') as f:
+        artifact = json.load(f)
+    bytecode = artifact['bytecode']
+    if isinstance(bytecode, dict):
+        bytecode = bytecode['object']
+    return {'abi': artifact['abi'], 'bytecode': bytecode}
+
+
+def count_requests(w3):
+    """
+        Adds a middleware to w3 that counts its JSON-RPC requests by method
+        Returns the Counter, which keeps updating as w3 is used
+    """
+    counts = Counter()
+
+    class RequestCounter(Web3Middleware):
+        def wrap_make_request(self, make_request):
+            def middleware(method, params):
+                counts[method] += 1
+                return make_request(method, params)
+            return middleware
+
+    w3.middleware_onion.add(RequestCounter, 'request_counter')
+    return counts
+
+
+def serialize_requests(w3, lock):
+    """
+        Makes every request through w3 hold `lock`
+        The in-process chain isn't thread safe, and the relay lanes, submitter,
+        watchdog and user all use it from different threads
+    """
+    class RequestLock(Web3Middleware):
+        def wrap_make_request(self, make_request):
+            def middleware(method, params):
+                with lock:
+                    return make_request(method, params)
+            return middleware
+
+    w3.middleware_onion.add(RequestLock, 'request_lock')
+
+
+class DevChain:
+    """
+        One local chain, with separate Web3 objects for the bridge and the
+        benchmark user so only the bridge's own RPC calls get counted
+        url - an anvil/hardhat node, or None for an in-process eth-tester chain
+    """
+
+    def __init__(self, url=None):
+        if url:
+            self.bridge_w3 = Web3(Web3.HTTPProvider(url))
+            self.user_w3 = Web3(Web3.HTTPProvider(url))
+        else:
+            provider = EthereumTesterProvider()
+            lock = threading.RLock()
+            self.bridge_w3 = Web3(provider)
+            self.user_w3 = Web3(provider)
+            serialize_requests(self.bridge_w3, lock)
+            serialize_requests(self.user_w3, lock)
+        self.rpc_counts = count_requests(self.bridge_w3)
+        # Dev nodes come with funded, unlocked accounts
+        self.user = self.user_w3.eth.accounts[0]
+
+    def fund(self, address, value=Web3.to_wei(100, 'ether')):
+        tx_hash = self.user_w3.eth.send_transaction({'from': self.user, 'to': address, 'value': value})
+        self.user_w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    def deploy(self, artifact, *args):
+        factory = self.user_w3.eth.contract(abi=artifact['abi'], bytecode=artifact['bytecode'])
+        tx_hash = factory.constructor(*args).transact({'from': self.user})
+        receipt = self.user_w3.eth.wait_for_transaction_receipt(tx_hash)
+        if not receipt.status:
+            raise RuntimeError(f"Deploying {args} failed: {tx_hash.hex()}")
+        return self.user_w3.eth.contract(address=receipt.contractAddress, abi=artifact['abi'])
+
+    def transact(self, call):
+        return call.transact({'from': self.user, 'gas': USER_GAS})
+
+
+class BridgeDeployment:
+    """
+        Source on one dev chain, Destination on the other, `num_tokens` test
+        ERC20s registered on both, with the warden as both contracts' admin
+    """
+
+    def __init__(self, source_chain, destination_chain, artifacts, num_tokens=4, supply=10 ** 30):
+        self.source_chain = source_chain
+        self.destination_chain = destination_chain
+        self.warden = TestSigner()
+        source_chain.fund(self.warden.address)
+        destination_chain.fund(self.warden.address)
+
+        source = source_chain.deploy(artifacts['Source'], self.warden.address)
+        destination = destination_chain.deploy(artifacts['Destination'], self.warden.address)
+        user = source_chain.user
+        self.tokens = [
+            source_chain.deploy(artifacts['BridgeToken'], '0x' + '00' * 20, f"Bench Token {i}", f"BT{i}", user)
+            for i in range(num_tokens)
+        ]
+
+        # The warden registers every token, one broadcast per chain
+        addresses = [token.address for token in self.tokens]
+        for chain, calls in [
+            (source_chain, [source.functions.registerToken(a) for a in addresses]),
+            (destination_chain, [destination.functions.createToken(a, f"Wrapped BT{i}", f"wBT{i}") for i, a in enumerate(addresses)]),
+        ]:
+            sent = send_transactions(chain.user_w3, self.warden, calls)
+            receipts = wait_for_receipts(chain.user_w3, [tx_hash for _, tx_hash in sent])
+            if len(sent) != len(calls) or not all(receipt.status for receipt in receipts.values()):
+                raise RuntimeError("Token registration failed")
+
+        # The user holds the test tokens and lets the contracts pull them
+        self.wrapped = {}
+        for token in self.tokens:
+            source_chain.user_w3.eth.wait_for_transaction_receipt(source_chain.transact(token.functions.mint(user, supply)))
+            source_chain.user_w3.eth.wait_for_transaction_receipt(source_chain.transact(token.functions.approve(source.address, supply)))
+            wrapped_address = destination.functions.wrapped_tokens(token.address).call()
+            wrapped = destination_chain.user_w3.eth.contract(address=wrapped_address, abi=artifacts['BridgeToken']['abi'])
+            destination_chain.user_w3.eth.wait_for_transaction_receipt(
+                destination_chain.transact(wrapped.functions.approve(destination.address, supply)))
+            self.wrapped[token.address] = wrapped
+
+        self.source = source
+        self.destination = destination
+        # The bridge's view of the contracts, on the counted Web3 objects
+        self.bridge_source = source_chain.bridge_w3.eth.contract(address=source.address, abi=source.abi)
+        self.bridge_destination = destination_chain.bridge_w3.eth.contract(address=destination.address, abi=destination.abi)
+
+
+def fire(chain, calls, rate, sent_at):
+    """
+        Sends the user transactions in `calls` at `rate` per second
+        Records the send time of each transaction hash in sent_at
+    """
+    start = time.perf_counter()
+    for i, call in enumerate(calls):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        send_time = time.perf_counter()
+        tx_hash = chain.transact(call)
+        sent_at[bytes(tx_hash).hex()] = send_time
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {f"p{point}": None for point in points}
+    return {f"p{point}": float(p) for point, p in zip(points, np.percentile(values, points))}
+
+
+def run_phase(deployment, mode, direction, count, rate, amount=10 ** 18, lanes=4, poll_interval=1,
+              batch_window=2, confirmations=(0, 0), timeout=300):
+    """
+        Runs the bridge in `mode` while the user fires `count` deposits
+        (direction='deposit') or unwraps (direction='unwrap') at `rate` per second
+        Waits until every event is relayed (or timeout) and returns the measurements
+    """
+    if direction == 'deposit':
+        chain = deployment.source_chain
+        calls = [deployment.source.functions.deposit(deployment.tokens[i % len(deployment.tokens)].address,
+                                                     chain.user, amount) for i in range(count)]
+    else:
+        chain = deployment.destination_chain
+        wrapped = list(deployment.wrapped.values())
+        calls = [deployment.destination.functions.unwrap(wrapped[i % len(wrapped)].address,
+                                                         deployment.source_chain.user, amount) for i in range(count)]
+
+    sent_at = {}
+    relayed_at = {}
+    failed = []
+    all_relayed = threading.Event()
+    lock = threading.Lock()
+
+    def on_relayed(tracked):
+        now = time.perf_counter()
+        event_ids = tracked.event_id if isinstance(tracked.event_id, list) else [tracked.event_id]
+        with lock:
+            for relayed_event_id in event_ids:
+                relayed_at[relayed_event_id] = now
+                if not tracked.receipt.status:
+                    failed.append(relayed_event_id)
+            if len(relayed_at) >= count:
+                all_relayed.set()
+
+    counts = [deployment.source_chain.rpc_counts, deployment.destination_chain.rpc_counts]
+    before = [Counter(c) for c in counts]
+    stop = threading.Event()
+    bridge = threading.Thread(target=bridge_loop, daemon=True, kwargs={
+        'source_contract': deployment.bridge_source,
+        'destination_contract': deployment.bridge_destination,
+        'signer': deployment.warden,
+        'mode': mode,
+        'confirmations': confirmations,
+        'poll_interval': poll_interval,
+        'batch_window': batch_window,
+        'lanes': lanes,
+        'stop': stop,
+        'on_relayed': on_relayed,
+    })
+    bridge.start()
+    # Let the loop read the starting head before the first event is sent
+    time.sleep(poll_interval)
+
+    started = time.perf_counter()
+    fire(chain, calls, rate, sent_at)
+    all_relayed.wait(timeout)
+    finished = max(relayed_at.values(), default=time.perf_counter())
+    stop.set()
+    bridge.join()
+
+    # Bridge events are "<deposit/unwrap tx hash>:<log index>"
+    latencies = []
+    for relayed_event_id, relay_time in relayed_at.items():
+        tx_hash = relayed_event_id.split(':')[0].removeprefix('0x')
+        if tx_hash in sent_at:
+            latencies.append(relay_time - sent_at[tx_hash])
+
+    rpc_calls = sum((c - b for c, b in zip(counts, before)), Counter())
+    relayed = len(relayed_at)
+    return {
+        'mode': mode,
+        'direction': direction,
+        'lanes': lanes,
+        'events': count,
+        'rate': rate,
+        'relayed': relayed,
+        'failed': len(failed),
+        'latency': percentiles(latencies),
+        'latency_mean': float(np.mean(latencies)) if latencies else None,
+        'events_per_sec': relayed / (finished - started) if relayed else 0.0,
+        'rpc_calls': sum(rpc_calls.values()),
+        'rpc_calls_per_relay': sum(rpc_calls.values()) / relayed if relayed else None,
+        'rpc_methods': dict(rpc_calls.most_common()),
+    }
+
+
+def _format(result):
+    latency = result['latency']
+    if latency['p50'] is None:
+        return f"{result['mode']:>6} {result['direction']:>7}: nothing relayed"
+    return (f"{result['mode']:>6} {result['direction']:>7}: {result['relayed']}/{result['events']} relayed, "
+            f"{result['events_per_sec']:.2f} events/s, latency p50={latency['p50']:.2f}s "
+            f"p95={latency['p95']:.2f}s p99={latency['p99']:.2f}s, "
+            f"{result['rpc_calls_per_relay']:.1f} RPC calls/relay")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure bridge relay latency and throughput on two local dev chains")
+    parser.add_argument('--artifacts', default='out', help="directory with compiled Source/Destination/BridgeToken JSON (forge or hardhat)")
+    parser.add_argument('--source-rpc', help="source dev node URL (in-process chain if omitted)")
+    parser.add_argument('--destination-rpc', help="destination dev node URL (in-process chain if omitted)")
+    parser.add_argument('--modes', default='single,batch')
+    parser.add_argument('--events', type=int, default=100, help="deposits (and then unwraps) per mode")
+    parser.add_argument('--rate', type=float, default=10, help="user transactions per second")
+    parser.add_argument('--tokens', type=int, default=4)
+    parser.add_argument('--lanes', type=int, default=4)
+    parser.add_argument('--poll-interval', type=float, default=1)
+    parser.add_argument('--batch-window', type=float, default=2)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', default='bridge_bench.json', help="where to write the results as JSON")
+    args = parser.parse_args()
+
+    try:
+        artifacts = {name: load_artifact(args.artifacts, name) for name in ARTIFACT_NAMES}
+    except Exception as e:
+        print(f"Failed to load contract artifacts: {e}")
+        raise SystemExit(1)
+
+    deployment = BridgeDeployment(DevChain(args.source_rpc), DevChain(args.destination_rpc), artifacts, args.tokens)
+    print(f"Deployed Source {deployment.source.address} and Destination {deployment.destination.address} "
+          f"with {args.tokens} tokens")
+
+    results = []
+    for mode in args.modes.split(','):
+        for direction in ['deposit', 'unwrap']:
+            result = run_phase(deployment, mode, direction, args.events, args.rate, lanes=args.lanes,
+                               poll_interval=args.poll_interval, batch_window=args.batch_window,
+                               timeout=args.timeout)
+            results.append(result)
+            print(_format(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'events': args.events, 'rate': args.rate, 'results': results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
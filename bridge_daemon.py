@@ -0,0 +1,483 @@
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import wait
+
+from structured_logging import get_logger
+
+
+# Where the daemon remembers up to which block each side's events were relayed
+CHECKPOINT_FILE = 'bridge_checkpoint.json'
+
+# The event each scanner picks up, by side (relayed to the other chain, see bridge.relay_job)
+SCANNED_EVENTS = {'source': 'Deposit', 'destination': 'Unwrap'}
+SIDE_CHAINS = {'source': 'avax', 'destination': 'bsc'}
+
+# A worker that hasn't sent anything for this many seconds is killed as hung
+HANG_TIMEOUT = 120
+
+# Delay before restarting a crashed worker, doubled each time it crashes again
+# soon after starting (within MIN_UPTIME seconds)
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+MIN_UPTIME = 60
+
+# Events the submitter couldn't send are handed to it again after this many
+# seconds, doubled each time they fail again
+RELAY_RETRY_DELAY = 5
+MAX_RELAY_RETRY_DELAY = 300
+
+# Event ids already handed to the submitter, remembered so a re-scan can't relay them twice
+MAX_FORWARDED = 100000
+
+log = get_logger('bridge_daemon')
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path, checkpoint):
+    # Written aside and renamed, so a crash never leaves half a file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def scan_worker(conn, side, from_block, contract_info, depth, poll_interval, ws_url):
+    """
+        Worker process streaming one side's events (LogStream) through a
+        ConfirmationTracker, and sending every poll
+            ('events', side, safe_block, confirmed_events)
+        where every event up to safe_block has been sent (this doubles as the heartbeat)
+        Starts at from_block, or at the head when that's None
+    """
+    import bridge
+    from confirmations import ConfirmationTracker
+    from head_tracker import get_head_tracker
+    from log_stream import LogStream
+
+    source_contract, destination_contract = bridge.get_contracts(contract_info)
+    contract = source_contract if side == 'source' else destination_contract
+    get_head_tracker(contract.w3, ws_url, poll_interval=min(2, poll_interval))
+    tracker = ConfirmationTracker(contract.w3, depth)
+    head, _ = tracker.poll_head()
+    if from_block is None:
+        from_block = head + 1
+    events = queue.Queue()
+    stream = LogStream(getattr(contract.events, SCANNED_EVENTS[side])(), ws_url, from_block, poll_interval,
+                       events=events)
+    stream.start()
+    log.info("Scanner started", extra={'side': side, 'from_block': from_block, 'pid': os.getpid()})
+
+    safe_block = from_block - 1
+    conn.send(('events', side, safe_block, []))
+    try:
+        while True:
+            head, fork_block = tracker.poll_head()
+            if fork_block is not None:
+                stream.rewind(fork_block + 1)
+            # Everything below next_block is delivered once the queue is drained.
+            # While subscribed next_block only moves when a log comes in, but the
+            # node pushes each block's logs as the block arrives, so every block
+            # below the head has been delivered as well
+            delivered_below = stream.next_block
+            if stream.mode == 'subscribed':
+                delivered_below = max(delivered_below, head)
+            scanned = []
+            try:
+                scanned.append(events.get(timeout=poll_interval))
+                while True:
+                    scanned.append(events.get_nowait())
+            except queue.Empty:
+                pass
+            tracker.add(scanned)
+            confirmed = tracker.pop_confirmed()
+            safe_block = max(safe_block, min(delivered_below - 1, head - depth))
+            conn.send(('events', side, safe_block, confirmed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.stop()
+
+
+def submit_worker(conn, contract_info, key_file, mode, batch_window, lanes, preflight):
+    """
+        Worker process relaying the events the supervisor sends as ('relay', seq, events)
+        Sends ('sent', event_ids) as soon as relays are broadcast (or quarantined),
+        ('done', seqs) once every event of those messages is out of its hands
+        (the ones never reported as sent failed, see Supervisor),
+        ('dropped', events) for sent relays whose nonce went to another
+        transaction, and ('heartbeat',) while idle
+    """
+    import bridge
+    from relay_lanes import RelayEngine
+    from signer import get_signer
+    from tx_watchdog import TxWatchdog, event_id
+
+    signer = get_signer(key_file)
+    source_contract, destination_contract = bridge.get_contracts(contract_info)
+    # The watchdog and the engine's threads report back on the same connection
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def report_sent(job):
+        log.info("Relay sent", extra={'function': job.function, 'tx_hash': job.tx_hash, 'nonce': job.nonce})
+        send(('sent', [event_id(event) for event in job.events]))
+
+    def report_quarantined(job):
+        log.warning("Relay quarantined", extra={**bridge.event_fields(job.event), 'function': job.function,
+                                                'reason': job.error.reason})
+        send(('sent', [event_id(job.event)]))
+
+    def report_relay(tracked):
+        fields = {'tx_hash': tracked.final_hash, 'event_id': tracked.event_id, 'block': tracked.receipt.blockNumber}
+        if tracked.receipt.status:
+            log.info("Relay confirmed", extra=fields)
+        else:
+            log.error("Relay failed", extra=fields)
+
+    # Acked when sent, so the supervisor has to be handed the events again
+    def report_dropped(tracked):
+        log.error("Relay dropped", extra={'tx_hash': tracked.tx_hash, 'event_id': tracked.event_id,
+                                          'nonce': tracked.nonce})
+        if tracked.job is not None and tracked.job.events:
+            send(('dropped', tracked.job.events))
+
+    watchdog = TxWatchdog(on_final=report_relay, on_dropped=report_dropped)
+    watchdog.start()
+    engine = RelayEngine(signer, watchdog, lanes=lanes, on_sent=report_sent, on_quarantined=report_quarantined)
+    log.info("Submitter started", extra={'warden': signer.address, 'mode': mode, 'pid': os.getpid()})
+
+    jobs = []
+    seqs = []
+    batch_started = None
+    try:
+        while True:
+            if conn.poll(1):
+                _, seq, events = conn.recv()
+                for event in events:
+                    log.info("Processing event", extra=bridge.event_fields(event))
+                    jobs.append(bridge.relay_job(event, source_contract, destination_contract))
+                seqs.append(seq)
+                if batch_started is None:
+                    batch_started = time.monotonic()
+            if seqs and (mode == 'single' or time.monotonic() - batch_started >= batch_window
+                         or len(jobs) >= bridge.MAX_BATCH):
+                round_jobs, jobs = jobs, []
+                try:
+                    relay_jobs = bridge.relay_round(engine, round_jobs, mode, preflight)
+                    # Only acknowledged once broadcast, so a crash before that relays them again
+                    for job in relay_jobs:
+                        job.done.wait()
+                except Exception as e:
+                    log.error("Failed to relay events", extra={'error': str(e)})
+                send(('done', seqs))
+                seqs = []
+                batch_started = None
+            else:
+                send(('heartbeat',))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+        watchdog.stop()
+
+
+class Worker:
+    """
+        One worker process of the supervisor, and the pipe to it
+        Messages to the worker go through a sender thread, so a worker that
+        stops reading can't block the supervisor
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.conn = None
+        self.outbox = None
+        self.started = None
+        self.last_seen = None
+        self.restarts = 0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0
+
+    def start(self, context, target, args):
+        conn, child_conn = context.Pipe()
+        self.process = context.Process(target=target, args=(child_conn, *args), name=f"bridge-{self.name}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = conn
+        self.started = self.last_seen = time.monotonic()
+        self.outbox = queue.Queue()
+        threading.Thread(target=self._send_loop, args=(conn, self.outbox), daemon=True).start()
+
+    @staticmethod
+    def _send_loop(conn, outbox):
+        while True:
+            message = outbox.get()
+            if message is None:
+                return
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                return
+
+    def send(self, message):
+        if self.outbox is not None:
+            self.outbox.put(message)
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=5):
+        if self.process is None:
+            return
+        self.outbox.put(None)
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = self.conn = self.outbox = None
+
+
+class Supervisor:
+    """
+        Runs the bridge as separate worker processes: one scanner per side and
+        one submitter that signs and broadcasts, so decoding and signing use
+        several cores and a stuck worker doesn't stall the others
+
+        Scanners send confirmed events to the supervisor, which forwards them to
+        the submitter and keeps them until the submitter has broadcast them.
+        Events the submitter gave up on are sent to it again after a backoff
+        (RELAY_RETRY_DELAY, doubling), and hold the checkpoint back meanwhile.
+        Relays the watchdog drops after they were sent are queued again, and
+        move the checkpoint back to their block until they are relayed.
+        The checkpoint file records, per side, the last block whose events were
+        all relayed, and the ids of the events above it that were relayed
+        already, so the re-scan after a restart doesn't relay them twice. A worker that crashes, or sends nothing for hang_timeout
+        seconds, is restarted: scanners from where they left off (from the
+        checkpoint when the daemon itself restarts), the submitter with every
+        event it hadn't broadcast yet.
+        An event broadcast right before a crash, but not yet reported as sent,
+        is relayed again, which the checkpoint can't rule out.
+    """
+
+    def __init__(self, mode='single', contract_info='contract_info.json', key_file='sk.txt',
+                 checkpoint_file=CHECKPOINT_FILE, confirmations=None, poll_interval=5, batch_window=None,
+                 lanes=None, preflight=True, stream=False, hang_timeout=HANG_TIMEOUT):
+        import bridge
+        self.mode = mode
+        self.contract_info = contract_info
+        self.key_file = key_file
+        self.checkpoint_file = checkpoint_file
+        self.confirmations = confirmations or (bridge.CONFIRMATIONS['avax'], bridge.CONFIRMATIONS['bsc'])
+        self.poll_interval = poll_interval
+        self.batch_window = bridge.BATCH_WINDOW if batch_window is None else batch_window
+        self.lanes = lanes or bridge.RELAY_LANES
+        self.preflight = preflight
+        self.stream = stream
+        self.hang_timeout = hang_timeout
+        # Fresh interpreters: the parent's threads and connections don't carry over
+        self.context = multiprocessing.get_context('spawn')
+        self.checkpoint = load_checkpoint(checkpoint_file)
+        # event id -> [side, block] of relayed events above the checkpoint
+        self.relayed = self.checkpoint.pop('relayed', {})
+        # Per side, every event up to this block has been forwarded
+        self.scanned = dict(self.checkpoint)
+        # seq -> (side, block everything before it was forwarded up to, {event_id: event})
+        self.unacked = OrderedDict()
+        # seq -> (failed attempts, when to hand it to the submitter again)
+        self.retries = {}
+        # event id -> (side, block) of every event handed to the submitter
+        self.forwarded = OrderedDict((key, tuple(value)) for key, value in self.relayed.items())
+        self.next_seq = 0
+        self.workers = {name: Worker(name) for name in ('source', 'destination', 'submitter')}
+
+    def _worker_args(self, name):
+        if name == 'submitter':
+            return submit_worker, (self.contract_info, self.key_file, self.mode, self.batch_window,
+                                   self.lanes, self.preflight)
+        from chain_config import get_chain
+        from_block = self.scanned[name] + 1 if name in self.scanned else None
+        depth = self.confirmations[0 if name == 'source' else 1]
+        ws_url = get_chain(SIDE_CHAINS[name]).ws if self.stream else None
+        return scan_worker, (name, from_block, self.contract_info, depth, self.poll_interval, ws_url)
+
+    def start_worker(self, worker):
+        target, args = self._worker_args(worker.name)
+        worker.start(self.context, target, args)
+        log.info("Worker started", extra={'worker': worker.name, 'pid': worker.process.pid,
+                                          'restarts': worker.restarts})
+        if worker.name == 'submitter':
+            for seq, (_, _, events) in self.unacked.items():
+                worker.send(('relay', seq, list(events.values())))
+            # Everything is back in its hands, retries included
+            self.retries = {seq: (attempts, None) for seq, (attempts, _) in self.retries.items()}
+
+    def restart_later(self, worker, reason):
+        uptime = time.monotonic() - worker.started
+        log.error("Worker stopped, restarting", extra={'worker': worker.name, 'reason': reason,
+                                                       'exitcode': worker.process.exitcode,
+                                                       'delay': worker.restart_delay})
+        worker.stop()
+        worker.restarts += 1
+        worker.restart_at = time.monotonic() + worker.restart_delay
+        # Back off while it keeps crashing right after starting
+        if uptime < MIN_UPTIME:
+            worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+        else:
+            worker.restart_delay = RESTART_DELAY
+
+    def handle(self, worker, message):
+        kind = message[0]
+        if kind == 'events':
+            _, side, safe_block, events = message
+            self._add_events(side, safe_block, events)
+        elif kind == 'sent':
+            sent = set(message[1])
+            for seq, (_, _, events) in list(self.unacked.items()):
+                for key in sent & events.keys():
+                    del events[key]
+        elif kind == 'done':
+            for seq in message[1]:
+                if seq not in self.unacked:
+                    continue
+                side, _, events = self.unacked[seq]
+                if not events:
+                    self.unacked.pop(seq)
+                    self.retries.pop(seq, None)
+                    continue
+                # Never reported as sent, so they failed: keep them and try again later
+                attempts, _ = self.retries.get(seq, (0, None))
+                delay = min(RELAY_RETRY_DELAY * 2 ** attempts, MAX_RELAY_RETRY_DELAY)
+                self.retries[seq] = (attempts + 1, time.monotonic() + delay)
+                log.warning("Relays not sent, retrying later", extra={'side': side, 'count': len(events),
+                                                                       'attempts': attempts + 1, 'delay': delay})
+            self._update_checkpoint()
+        elif kind == 'dropped':
+            self._requeue(message[1])
+
+    def _requeue(self, events):
+        from tx_watchdog import event_id
+        sides = {event_name: side for side, event_name in SCANNED_EVENTS.items()}
+        by_side = OrderedDict()
+        for event in events:
+            by_side.setdefault(sides[event.event], OrderedDict())[event_id(event)] = event
+        for side, side_events in by_side.items():
+            self.next_seq += 1
+            previous = min(event.blockNumber for event in side_events.values()) - 1
+            self.unacked[self.next_seq] = (side, previous, side_events)
+            self.workers['submitter'].send(('relay', self.next_seq, list(side_events.values())))
+            log.warning("Relays dropped, queued again", extra={'side': side, 'count': len(side_events)})
+        self._update_checkpoint()
+
+    def retry_due(self, now):
+        """
+            Hands the submitter the failed events whose backoff is over
+        """
+        submitter = self.workers['submitter']
+        if submitter.process is None:
+            return
+        for seq, (attempts, retry_at) in list(self.retries.items()):
+            if retry_at is not None and now >= retry_at:
+                self.retries[seq] = (attempts, None)
+                submitter.send(('relay', seq, list(self.unacked[seq][2].values())))
+
+    def _add_events(self, side, safe_block, events):
+        from tx_watchdog import event_id
+        previous = self.scanned.get(side)
+        new = OrderedDict()
+        for event in events:
+            key = event_id(event)
+            if key not in self.forwarded:
+                new[key] = event
+                self.forwarded[key] = (side, event.blockNumber)
+        while len(self.forwarded) > MAX_FORWARDED:
+            self.forwarded.popitem(last=False)
+        if previous is None or safe_block > previous:
+            self.scanned[side] = safe_block
+        if new:
+            self.next_seq += 1
+            self.unacked[self.next_seq] = (side, previous, new)
+            self.workers['submitter'].send(('relay', self.next_seq, list(new.values())))
+        self._update_checkpoint()
+
+    def _update_checkpoint(self):
+        checkpoint = dict(self.scanned)
+        for side, previous, _ in self.unacked.values():
+            # Only up to where the oldest unrelayed events of that side start
+            if previous is None:
+                checkpoint.pop(side, None)
+            elif side in checkpoint:
+                checkpoint[side] = min(checkpoint[side], previous)
+        checkpoint = {**self.checkpoint, **checkpoint}
+        unrelayed = {key for _, _, events in self.unacked.values() for key in events}
+        relayed = {key: [side, block] for key, (side, block) in self.forwarded.items()
+                   if block > checkpoint.get(side, -1) and key not in unrelayed}
+        if checkpoint != self.checkpoint or relayed != self.relayed:
+            save_checkpoint(self.checkpoint_file, {**checkpoint, 'relayed': relayed})
+            self.checkpoint = checkpoint
+            self.relayed = relayed
+
+    def run(self, stop=None):
+        """
+            Starts the workers and keeps them running until Ctrl+C (or `stop` is set)
+        """
+        stop = stop or threading.Event()
+        log.info("Starting bridge daemon", extra={'mode': self.mode, 'checkpoint': self.checkpoint})
+        for worker in self.workers.values():
+            self.start_worker(worker)
+        try:
+            while not stop.is_set():
+                running = {worker.conn: worker for worker in self.workers.values() if worker.process is not None}
+                for conn in wait(list(running), timeout=1):
+                    worker = running[conn]
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        # Gone, noticed below
+                        continue
+                    worker.last_seen = time.monotonic()
+                    self.handle(worker, message)
+
+                now = time.monotonic()
+                self.retry_due(now)
+                for worker in self.workers.values():
+                    if worker.process is None:
+                        if now >= worker.restart_at:
+                            self.start_worker(worker)
+                    elif not worker.alive():
+                        self.restart_later(worker, 'crashed')
+                    elif now - worker.last_seen > self.hang_timeout:
+                        self.restart_later(worker, 'hung')
+        except KeyboardInterrupt:
+            log.info("Bridge daemon stopped by user")
+        finally:
+            for worker in self.workers.values():
+                worker.stop()
+            self._update_checkpoint()
+
+
+def run_daemon(mode='single', **kwargs):
+    """
+        `python bridge.py daemon [single|batch] [poll|stream]`, see Supervisor
+    """
+    if mode not in ['single', 'batch']:
+        log.error("Invalid relay mode", extra={'mode': mode})
+        return
+    Supervisor(mode, **kwargs).run()
@@ -0,0 +1,190 @@
+import functools
+import json
+import os
+from pathlib import Path
+
+from web3 import Web3
+from web3.middleware import ExtraDataToPOAMiddleware #Necessary for POA chains
+
+from rate_limit import RateLimitedProvider
+from rpc_failover import FailoverProvider
+from rpc_replay import ReplayProvider, get_recorder
+
+
+# Used when there is no chains.json, or for chains it doesn't mention
+DEFAULT_CHAINS = {
+    'avax': {  # AVAX C-chain testnet, the bridge's source chain
+        'poa': True,
+        'endpoints': [{'url': "https://api.avax-test.network/ext/bc/C/rpc", 'weight': 1, 'rps': 20}],
+        'ws': "wss://api.avax-test.network/ext/bc/C/ws",
+    },
+    'bsc': {  # BSC testnet, the bridge's destination chain
+        'poa': True,
+        'endpoints': [{'url': "https://data-seed-prebsc-1-s1.binance.org:8545/", 'weight': 1, 'rps': 10}],
+    },
+    'eth': {  # Ethereum mainnet
+        'poa': False,
+        'endpoints': [{'url': "https://mainnet.infura.io/v3/40fd20c85d75423692cc1eba75727f5f", 'weight': 1, 'rps': 10}],
+        'ws': "wss://mainnet.infura.io/ws/v3/40fd20c85d75423692cc1eba75727f5f",
+    },
+}
+
+MODULE_DIR = Path(__file__).parent.absolute()
+
+
+class Endpoint:
+    """
+        rps/burst - client-side rate limit for this endpoint (None for no limit)
+    """
+
+    def __init__(self, url, weight=1, rps=None, burst=None):
+        self.url = url
+        self.weight = weight
+        self.rps = rps
+        self.burst = burst
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, weight={self.weight})"
+
+
+class ChainConfig:
+    """
+        The RPC endpoints for one chain
+        weight - how strongly an endpoint is preferred (its latency is divided by it)
+        poa - inject ExtraDataToPOAMiddleware (needed for Avalanche and BSC)
+        ws - WebSocket URL for subscriptions (None if the chain has none)
+    """
+
+    def __init__(self, name, endpoints, poa=False, ws=None):
+        self.name = name
+        self.endpoints = endpoints
+        self.poa = poa
+        self.ws = ws
+
+
+def _parse_endpoints(entries):
+    endpoints = []
+    for entry in entries:
+        if isinstance(entry, str):
+            endpoints.append(Endpoint(entry))
+        else:
+            endpoints.append(Endpoint(entry['url'], entry.get('weight', 1), entry.get('rps'), entry.get('burst')))
+    return endpoints
+
+
+def config_path():
+    return Path(os.environ.get('CHAIN_CONFIG', MODULE_DIR / 'chains.json'))
+
+
+@functools.lru_cache(maxsize=None)
+def load_chains(path=None):
+    """
+        Reads the chain registry once per process
+        chains.json (or the file in $CHAIN_CONFIG) has the same layout as
+        DEFAULT_CHAINS and overrides it chain by chain, e.g.
+            {"avax": {"poa": true, "endpoints": [{"url": "http://127.0.0.1:8545", "weight": 3, "rps": 100}, "https://..."]}}
+        RPC_URL_<CHAIN> (comma separated URLs) and WS_URL_<CHAIN> override both, e.g.
+            RPC_URL_AVAX=http://127.0.0.1:8545 python bridge.py listen
+    """
+    raw = {name: dict(chain) for name, chain in DEFAULT_CHAINS.items()}
+    path = Path(path) if path else config_path()
+    if path.is_file():
+        with open(path, 'r') as f:
+            for name, chain in json.load(f).items():
+                raw[name] = {**raw.get(name, {}), **chain}
+
+    chains = {}
+    for name, chain in raw.items():
+        endpoints = chain.get('endpoints', [])
+        env_urls = os.environ.get(f"RPC_URL_{name.upper()}")
+        if env_urls:
+            endpoints = [url.strip() for url in env_urls.split(',') if url.strip()]
+        ws = os.environ.get(f"WS_URL_{name.upper()}", chain.get('ws'))
+        chains[name] = ChainConfig(name, _parse_endpoints(endpoints), chain.get('poa', False), ws)
+    return chains
+
+
+def get_chain(chain):
+    chains = load_chains()
+    if chain not in chains:
+        raise ValueError(f"Invalid chain: {chain}")
+    return chains[chain]
+
+
+def endpoint_provider(endpoint, timeout=10, **kwargs):
+    """
+        HTTP provider for one endpoint, behind its rate limiter and retries
+    """
+    # Retries are done by RateLimitedProvider, under the global retry budget
+    provider = Web3.HTTPProvider(endpoint.url, request_kwargs={'timeout': timeout}, exception_retry_configuration=None)
+    return RateLimitedProvider(provider, endpoint.rps, endpoint.burst, **kwargs)
+
+
+def connect(chain):
+    """
+        Returns a new Web3 instance for the chain
+        Chains with several endpoints get a FailoverProvider over all of them
+        RPC_RECORD=<file> records every request/response to file, and
+        RPC_REPLAY=<file> answers from such a recording instead of the endpoints
+        (waiting RPC_REPLAY_SCALE times the recorded latency, 0 by default)
+    """
+    config = get_chain(chain)
+    replay = os.environ.get('RPC_REPLAY')
+    if replay:
+        w3 = Web3(ReplayProvider(replay, chain, float(os.environ.get('RPC_REPLAY_SCALE', 0))))
+    elif len(config.endpoints) > 1:
+        # Route between all of them by latency, with failover (which is itself
+        # a retry, so each endpoint only retries once before giving up its turn)
+        w3 = Web3(FailoverProvider([(endpoint_provider(e, max_retries=1), e.weight) for e in config.endpoints]))
+    else:
+        w3 = Web3(endpoint_provider(config.endpoints[0]))
+    if config.poa:
+        # inject the poa compatibility middleware to the innermost layer
+        w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+    record = os.environ.get('RPC_RECORD')
+    if record:
+        get_recorder(record).attach(w3, chain)
+    return w3
+
+
+@functools.lru_cache(maxsize=None)
+def get_web3(chain):
+    """
+        The process-wide Web3 instance for a chain, so repeated calls reuse the
+        same provider (and its HTTP connection pool)
+    """
+    return connect(chain)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_json(path, mtime_ns):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def load_json(filename):
+    """
+        Parses a JSON file once and returns the cached result on later calls
+        (re-read only if the file changes). The result is shared, don't modify it
+    """
+    path = os.path.abspath(filename)
+    return _load_json(path, os.stat(path).st_mtime_ns)
+
+
+def load_contract_info(contract_info='contract_info.json'):
+    return load_json(contract_info)
+
+
+@functools.lru_cache(maxsize=None)
+def _contract(chain, role, path, mtime_ns):
+    info = _load_json(path, mtime_ns)[role]
+    return get_web3(chain).eth.contract(address=info['address'], abi=info['abi'])
+
+
+def get_contract(chain, role, contract_info='contract_info.json'):
+    """
+        Cached contract object for contract_info[role] on `chain`'s shared Web3
+        e.g. get_contract('avax', 'source')
+    """
+    path = os.path.abspath(contract_info)
+    return _contract(chain, role, path, os.stat(path).st_mtime_ns)
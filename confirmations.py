@@ -0,0 +1,177 @@
+from collections import OrderedDict
+
+from head_tracker import latest_block
+from structured_logging import get_logger
+
+
+log = get_logger('confirmations')
+
+
+class BlockHashRing:
+    """
+        Remembers the hashes of the last `size` blocks seen on a chain
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self._hashes = OrderedDict()
+
+    def add(self, number, block_hash):
+        self._hashes[number] = bytes(block_hash)
+        self._hashes.move_to_end(number)
+        while len(self._hashes) > self.size:
+            self._hashes.popitem(last=False)
+
+    def get(self, number):
+        return self._hashes.get(number)
+
+    def discard_above(self, number):
+        for n in [n for n in self._hashes if n > number]:
+            del self._hashes[n]
+
+
+class ConfirmationTracker:
+    """
+        Holds events until they are `depth` blocks deep and drops events from
+        blocks that were reorged out before they got there
+
+        Logs are still scanned right up to the head (so they are seen with no
+        extra delay), but only released by pop_confirmed() once they are
+        confirmed and their block hash still matches the canonical chain.
+        Reorgs are noticed from the head's parentHash, using a ring buffer of
+        recently seen block hashes, which costs one header fetch per poll
+        (none if the chain has a HeadTracker running) plus one per block
+        skipped when the head moved by more than one.
+    """
+
+    def __init__(self, w3, depth=0, ring_size=128):
+        self.w3 = w3
+        self.depth = depth
+        self.ring = BlockHashRing(ring_size)
+        self.head = None
+        self._pending = []
+        # event key -> block number, for every event queued or released recently
+        self._seen = {}
+        # Set when pop_confirmed finds an orphaned block the head check missed
+        self._orphaned_below = None
+
+    def poll_head(self):
+        """
+            Fetches the latest header and checks it extends the blocks seen so far
+            Returns (head, fork_block): fork_block is None normally, and after a
+            reorg it is the last block both chains agree on, so logs need to be
+            re-scanned from fork_block + 1
+        """
+        block = latest_block(self.w3)
+        headers = self._headers_since_head(block)
+        oldest = headers[-1]
+        fork_block = None
+        known_parent = self.ring.get(oldest.number - 1)
+        if (known_parent is not None and known_parent != bytes(oldest.parentHash)) or \
+                any(self.ring.get(header.number) not in (None, bytes(header.hash)) for header in headers) or \
+                (self.head is not None and block.number < self.head):
+            fork_block = self._find_fork(min(block.number - 1, self.head))
+        elif self.head is not None and oldest.number - 1 > self.head:
+            # Jumped further than the ring reaches, check the last head directly
+            fork_block = self._find_fork(self.head)
+            if fork_block == self.head:
+                fork_block = None
+        if self._orphaned_below is not None:
+            fork_block = self._orphaned_below if fork_block is None else min(fork_block, self._orphaned_below)
+            self._orphaned_below = None
+        if fork_block is not None:
+            self._rollback(fork_block)
+
+        self.ring.add(oldest.number - 1, oldest.parentHash)
+        for header in reversed(headers):
+            self.ring.add(header.number, header.hash)
+        self.head = block.number
+        return self.head, fork_block
+
+    def _headers_since_head(self, block):
+        # When the head moved several blocks at once, the blocks in between
+        # (fetched by parentHash, so from the same chain as block) are checked
+        # against the ring too, a reorg under them would go unnoticed otherwise
+        headers = [block]
+        while self.head is not None and headers[-1].number - 1 > self.head and len(headers) < self.ring.size:
+            headers.append(self.w3.eth.get_block(headers[-1].parentHash))
+        return headers
+
+    def _find_fork(self, number):
+        # Walk back until a block still has the hash we saw for it
+        while number >= 0:
+            known = self.ring.get(number)
+            if known is None:
+                # Older than the ring buffer, assume it is settled
+                return number
+            if bytes(self.w3.eth.get_block(number).hash) == known:
+                return number
+            number -= 1
+        return -1
+
+    def _rollback(self, fork_block):
+        orphaned = [event for event in self._pending if event.blockNumber > fork_block]
+        self._pending = [event for event in self._pending if event.blockNumber <= fork_block]
+        for event in orphaned:
+            self._seen.pop(self._event_key(event), None)
+        self.ring.discard_above(fork_block)
+        if orphaned:
+            log.warning("Reorg, dropped pending events", extra={'fork_block': fork_block, 'count': len(orphaned)})
+        return orphaned
+
+    @staticmethod
+    def _event_key(event):
+        return bytes(event.blockHash), bytes(event.transactionHash), event.logIndex
+
+    def add(self, events):
+        """
+            Queue newly scanned events (duplicates are ignored)
+        """
+        for event in events:
+            key = self._event_key(event)
+            if key not in self._seen:
+                self._seen[key] = event.blockNumber
+                self._pending.append(event)
+
+    def pending(self):
+        return list(self._pending)
+
+    def pop_confirmed(self):
+        """
+            Returns the queued events that are at least `depth` blocks deep and
+            still in the canonical chain, in block/log order
+        """
+        if self.head is None:
+            return []
+        ready = []
+        keep = []
+        orphaned = []
+        for event in self._pending:
+            if event.blockNumber > self.head - self.depth:
+                keep.append(event)
+                continue
+            canonical = self.ring.get(event.blockNumber)
+            if canonical is None:
+                canonical = bytes(self.w3.eth.get_block(event.blockNumber).hash)
+                self.ring.add(event.blockNumber, canonical)
+            if canonical == bytes(event.blockHash):
+                ready.append(event)
+            else:
+                orphaned.append(event)
+
+        self._pending = keep
+        for event in orphaned:
+            self._seen.pop(self._event_key(event), None)
+        if orphaned:
+            # Their blocks were replaced, so the next poll_head asks for a re-scan
+            fork_block = min(event.blockNumber for event in orphaned) - 1
+            if self._orphaned_below is None or fork_block < self._orphaned_below:
+                self._orphaned_below = fork_block
+            log.warning("Dropped events from orphaned blocks", extra={'fork_block': fork_block, 'count': len(orphaned)})
+
+        # Released events only need remembering while a re-scan could still reach them
+        oldest = self.head - self.ring.size
+        for key in [key for key, number in self._seen.items() if number < oldest]:
+            del self._seen[key]
+        ready.sort(key=lambda event: (event.blockNumber, event.logIndex))
+        return ready
@@ -1,7 +1,6 @@
-import json
 from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware
-from web3.providers.rpc import HTTPProvider
+
+from chain_config import get_web3, load_json
 
 '''
 If you use one of the suggested infrastructure providers, the url will be of the form
@@ -11,28 +10,25 @@ infura_url = f"https://mainnet.infura.io/v3/{infura_token}"
 '''
 
 def connect_to_eth():
-	url = "https://mainnet.infura.io/v3/40fd20c85d75423692cc1eba75727f5f"  # FILL THIS IN
-	w3 = Web3(HTTPProvider(url))
-	assert w3.is_connected(), f"Failed to connect to provider at {url}"
+	# Mainnet endpoints come from chain_config (chains.json / RPC_URL_ETH)
+	w3 = get_web3('eth')
+	assert w3.is_connected(), f"Failed to connect to provider at {w3.provider.endpoint_uri}"
 	return w3
 
 
 def connect_with_middleware(contract_json):
-	with open(contract_json, "r") as f:
-		d = json.load(f)
-		d = d['bsc']
-		address = d['address']
-		abi = d['abi']
+	d = load_json(contract_json)['bsc']
+	address = d['address']
+	abi = d['abi']
 
 	# TODO complete this method
 	# The first section will be the same as "connect_to_eth()" but with a BNB url
 	# 使用BNB测试网的URL
-	bnb_url = "https://data-seed-prebsc-1-s1.binance.org:8545/"
-	w3 = Web3(HTTPProvider(bnb_url))
-	w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+	# The bsc endpoint is configured with the POA middleware
+	w3 = get_web3('bsc')
 	
 	# 验证连接
-	assert w3.is_connected(), f"Failed to connect to BNB provider at {bnb_url}"
+	assert w3.is_connected(), f"Failed to connect to BNB provider at {w3.provider.endpoint_uri}"
 
 	# The second section requires you to inject middleware into your w3 object and
 	# create a contract object. Read more on the docs pages at https://web3py.readthedocs.io/en/stable/middleware.html
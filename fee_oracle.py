@@ -0,0 +1,106 @@
+import statistics
+import threading
+import time
+import weakref
+
+from head_tracker import latest_block
+
+
+class FeeOracle:
+    """
+        Per-chain source of transaction fee fields and gas limits
+
+        Fees are cached for `ttl` seconds, so a burst of relays shares one RPC call.
+        On EIP-1559 chains (latest block has a non-zero baseFeePerGas) the fees come
+        from eth_feeHistory: the priority fee is the median of the `percentile`
+        reward over the last `history_blocks` blocks, and maxFeePerGas leaves room
+        for the base fee to rise for `base_fee_headroom` x the next block's base fee.
+        Other chains get a plain gasPrice (times `legacy_multiplier`).
+
+        Gas estimates are cached per (contract, function selector) and padded by
+        `gas_headroom`, since calls to the same function cost about the same
+        (batch calls are also keyed by their batch size).
+    """
+
+    def __init__(self, w3, ttl=3.0, history_blocks=10, percentile=50, base_fee_headroom=2,
+                 legacy_multiplier=1.0, gas_headroom=1.25, gas_ttl=600.0):
+        self.w3 = w3
+        self.ttl = ttl
+        self.history_blocks = history_blocks
+        self.percentile = percentile
+        self.base_fee_headroom = base_fee_headroom
+        self.legacy_multiplier = legacy_multiplier
+        self.gas_headroom = gas_headroom
+        self.gas_ttl = gas_ttl
+        self._lock = threading.Lock()
+        self._fees = None
+        self._fees_time = 0
+        self._gas = {}
+
+    def fee_fields(self):
+        """
+            Returns the fee part of a transaction dict, either
+            {'maxFeePerGas', 'maxPriorityFeePerGas'} or {'gasPrice'}
+        """
+        with self._lock:
+            if self._fees is None or time.monotonic() - self._fees_time > self.ttl:
+                self._fees = self._fetch_fees()
+                self._fees_time = time.monotonic()
+            return dict(self._fees)
+
+    def invalidate(self):
+        """
+            Forget the cached fees, e.g. after a transaction was underpriced
+        """
+        with self._lock:
+            self._fees = None
+
+    def _fetch_fees(self):
+        history = self.w3.eth.fee_history(self.history_blocks, 'latest', [self.percentile])
+        # The last base fee in the history is the one for the next block
+        if history['baseFeePerGas']:
+            next_base_fee = history['baseFeePerGas'][-1]
+        else:
+            next_base_fee = latest_block(self.w3).get('baseFeePerGas', 0)
+        if not next_base_fee:
+            return {'gasPrice': int(self.w3.eth.gas_price * self.legacy_multiplier)}
+
+        rewards = [reward[0] for reward in history.get('reward') or [] if reward]
+        priority_fee = int(statistics.median(rewards)) if rewards else self.w3.eth.max_priority_fee
+        return {
+            'maxPriorityFeePerGas': priority_fee,
+            'maxFeePerGas': int(next_base_fee * self.base_fee_headroom) + priority_fee,
+        }
+
+    def estimate_gas(self, call, sender, size=None):
+        """
+            Gas limit for a contract call like contract.functions.wrap(...)
+            Estimated once per (contract, function selector, size) and reused
+        """
+        key = (call.address, call.selector, size)
+        with self._lock:
+            cached = self._gas.get(key)
+        if cached and time.monotonic() - cached[1] < self.gas_ttl:
+            return cached[0]
+
+        gas = int(call.estimate_gas({'from': sender}) * self.gas_headroom)
+        with self._lock:
+            self._gas[key] = (gas, time.monotonic())
+        return gas
+
+
+_oracles = weakref.WeakKeyDictionary()
+_oracles_lock = threading.Lock()
+
+
+def get_fee_oracle(w3, **kwargs):
+    """
+        Returns the FeeOracle for a web3 connection, creating it the first time
+        kwargs are only used when the oracle is created
+    """
+    with _oracles_lock:
+        oracle = _oracles.get(w3)
+        if oracle is None:
+            oracle = FeeOracle(w3, **kwargs)
+            _oracles[w3] = oracle
+        return oracle
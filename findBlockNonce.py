@@ -1,7 +1,16 @@
 #!/bin/python
+import array
+import atexit
 import hashlib
+import heapq
+import itertools
+import math
+import mmap
+import multiprocessing
 import os
 import random
+import threading
+from collections import OrderedDict, deque
 
 
 def mine_block(k, prev_hash, transactions):
@@ -18,55 +27,270 @@ def mine_block(k, prev_hash, transactions):
         print("mine_block expects positive integer")
         return b'\x00'
 
-    # Convert transactions list to bytes
-    transactions_bytes = b''
-    for transaction in transactions:
-        transactions_bytes += transaction.encode('utf-8')
-    
-    # Create a mask for checking trailing zeros
-    # We want k trailing zeros, so we create a mask with k ones
-    # For example, if k=3, mask = 0b111 = 7
-    mask = (1 << k) - 1
-    
-    nonce = 0
-    while True:
-        # Convert nonce to bytes
-        nonce_bytes = str(nonce).encode('utf-8')
-        
-        # Combine prev_hash + transactions + nonce
-        combined_data = prev_hash + transactions_bytes + nonce_bytes
-        
-        # Calculate SHA256 hash
-        hash_result = hashlib.sha256(combined_data).digest()
-        
-        # Convert hash to integer to check trailing bits
-        hash_int = int.from_bytes(hash_result, byteorder='big')
-        
-        # Check if the last k bits are zeros
-        if (hash_int & mask) == 0:
-            break
-            
-        nonce += 1
+    # Convert transactions list to bytes (a single join avoids quadratic +=)
+    transactions_bytes = b''.join(transaction.encode('utf-8') for transaction in transactions)
+
+    # prev_hash + transactions is the same for every nonce, so hash it once
+    # and copy the primed state instead of rehashing the whole prefix
+    prefix_hash = hashlib.sha256(prev_hash)
+    prefix_hash.update(transactions_bytes)
+
+    nonce = _search_nonces(k, prefix_hash, 0)
+    nonce_bytes = str(nonce).encode('utf-8')
 
     assert isinstance(nonce_bytes, bytes), 'nonce should be of type bytes'
     return nonce_bytes
 
 
-def get_random_lines(filename, quantity):
+def _search_nonces(k, prefix_hash, start, stop=None):
+    """
+        Tries the nonces start, start + 1, ... (up to but not including stop)
+        against the primed prefix_hash and returns the first one whose hash
+        has k trailing zero bits, or None if the range is exhausted
+    """
+    # k trailing zero bits means the last k // 8 bytes of the digest are zero
+    # and the low k % 8 bits of the byte before them are zero
+    zero_bytes, zero_bits = divmod(k, 8)
+    zero_tail = bytes(zero_bytes)
+    partial_index = -zero_bytes - 1 if zero_bytes < 32 else -1
+    partial_mask = (1 << zero_bits) - 1
+
+    nonces = itertools.count(start) if stop is None else range(start, stop)
+    for nonce in nonces:
+        # sha256( prev_hash + transactions + nonce ) from the primed prefix
+        block_hash = prefix_hash.copy()
+        block_hash.update(str(nonce).encode('utf-8'))
+        hash_result = block_hash.digest()
+
+        # Check the trailing bits directly on the digest bytes
+        if hash_result.endswith(zero_tail) and not (hash_result[partial_index] & partial_mask):
+            return nonce
+    return None
+
+
+def _search_chunk(args):
+    """
+        Worker for mine_block_parallel, searches one chunk of nonces
+        hashlib objects can't be pickled so each chunk re-primes the prefix
+        Returns (nonce or None, number of hashes tried)
+    """
+    k, prefix, start, stop = args
+    nonce = _search_nonces(k, hashlib.sha256(prefix), start, stop)
+    return nonce, (stop - start if nonce is None else nonce - start + 1)
+
+
+def mine_block_parallel(k, prev_hash, transactions, workers=None, chunk_size=1 << 16, stats=None):
+    """
+        Same result as mine_block, but the nonce space is split into chunks
+        of chunk_size that are searched by a pool of worker processes
+        Chunks are collected in order, so the first hit is the smallest
+        valid nonce and the answer matches the serial miner
+        stats - a dict that gets 'hashes', the hashes tried by all workers
+                (chunks already handed out past the winning nonce included)
+    """
+    if not isinstance(k, int) or k < 0:
+        print("mine_block expects positive integer")
+        return b'\x00'
+
+    prefix = prev_hash + b''.join(transaction.encode('utf-8') for transaction in transactions)
+    starts = itertools.count(0, chunk_size)
+    # Two chunks in flight per worker keeps them busy without queueing far past the answer
+    window = 2 * (workers or os.cpu_count() or 1)
+
+    nonce = None
+    hashes = 0
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        while nonce is None:
+            while len(pending) < window:
+                start = next(starts)
+                pending.append(pool.apply_async(_search_chunk, ((k, prefix, start, start + chunk_size),)))
+            nonce, tried = pending.popleft().get()
+            hashes += tried
+        # The chunks after the winner are searched all the same, count that work too
+        for result in pending:
+            hashes += result.get()[1]
+        pool.terminate()
+    if stats is not None:
+        stats['hashes'] = hashes
+
+    nonce_bytes = str(nonce).encode('utf-8')
+    assert isinstance(nonce_bytes, bytes), 'nonce should be of type bytes'
+    return nonce_bytes
+
+
+def get_random_lines(filename, quantity, use_index=False, replace=True):
     """
     This is a helper function to get the quantity of lines ("transactions")
-    as a list from the filename given. 
-    Do not modify this function
+    as a list from the filename given.
+    As before, exactly quantity lines are returned, each drawn independently
+    (so with replacement), but now uniformly from the whole file rather than
+    from its first quantity lines. replace=False returns distinct lines instead
+    (only as many as the file has, if it is shorter than quantity).
+    By default the file is streamed once in constant memory; with
+    use_index=True an mmap'ed line-offset index is built once per file and
+    reused, so repeated sampling from the same corpus costs O(quantity)
+    """
+    if use_index:
+        return _line_index(filename).sample(quantity, replace=replace)
+    if replace:
+        return sample_with_replacement(filename, quantity)
+    return reservoir_sample(filename, quantity)
+
+
+def _uniform(rng):
+    # In (0, 1], so its log is always defined
+    return 1.0 - rng.random()
+
+
+def reservoir_sample(filename, quantity, rng=random):
     """
-    lines = []
+    Uniformly samples quantity distinct lines from filename in a single pass
+    Uses reservoir sampling "Algorithm L", which jumps over runs of lines
+    that can't enter the reservoir instead of drawing a random number per line
+    Returns fewer lines if the file has fewer than quantity lines
+    """
+    if quantity <= 0:
+        return []
+
+    with open(filename, 'r') as f:
+        reservoir = [line.strip() for line in itertools.islice(f, quantity)]
+        if len(reservoir) < quantity:
+            rng.shuffle(reservoir)
+            return reservoir
+
+        w = math.exp(math.log(_uniform(rng)) / quantity)
+        while True:
+            # Number of lines to skip before the next one that replaces an entry
+            skip = math.floor(math.log(_uniform(rng)) / math.log(1 - w)) if w < 1 else 0
+            line = next(itertools.islice(f, skip, None), None)
+            if line is None:
+                break
+            reservoir[rng.randrange(quantity)] = line.strip()
+            w *= math.exp(math.log(_uniform(rng)) / quantity)
+
+    return reservoir
+
+
+def sample_with_replacement(filename, quantity, rng=random):
+    """
+    quantity lines drawn independently and uniformly from filename, in a single pass
+    Each pick is its own reservoir of one line (Algorithm L with k = 1), and a
+    heap of the line numbers where a pick changes next lets the file be read
+    once for all of them
+    Returns [] for an empty file
+    """
+    if quantity <= 0:
+        return []
+
+    picks = [None] * quantity
+    # (line number where the pick is replaced next, pick, its w)
+    upcoming = [(0, i, 1.0) for i in range(quantity)]
+    heapq.heapify(upcoming)
     with open(filename, 'r') as f:
-        for line in f:
-            lines.append(line.strip())
+        number = -1
+        line = None
+        while upcoming:
+            target, i, w = upcoming[0]
+            if target > number:
+                line = next(itertools.islice(f, target - number - 1, None), None)
+                if line is None:
+                    break
+                number = target
+            picks[i] = line.strip()
+            w *= _uniform(rng)
+            skip = math.floor(math.log(_uniform(rng)) / math.log(1 - w)) if w < 1 else 0
+            heapq.heapreplace(upcoming, (target + skip + 1, i, w))
+
+    if picks and picks[0] is None:
+        # Empty file
+        return []
+    return picks
+
+
+class LineIndex:
+    """
+    Memory maps a text file and records the byte offset of every line so
+    that random lines can be read without scanning the file again
+    close() unmaps the file (cached indexes are closed when they are replaced)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self._map = b''
+            else:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # offsets[i] is where line i starts, and the last entry is the end of the file
+        offsets = array.array('Q', [0])
+        position = self._map.find(b'\n')
+        while position != -1:
+            offsets.append(position + 1)
+            position = self._map.find(b'\n', position + 1)
+        if offsets[-1] != len(self._map):
+            offsets.append(len(self._map))
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, i):
+        return self._map[self.offsets[i]:self.offsets[i + 1]].decode('utf-8').strip()
+
+    def sample(self, quantity, rng=random, replace=True):
+        """
+        Returns quantity lines chosen uniformly at random, independently
+        (replace=True) or distinct (all of them, shuffled, if the file is
+        shorter than quantity)
+        """
+        if quantity <= 0 or not len(self):
+            return []
+        if replace:
+            picks = rng.choices(range(len(self)), k=quantity)
+        else:
+            picks = rng.sample(range(len(self)), min(quantity, len(self)))
+        return [self.line(i) for i in picks]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+# Most recently used LineIndexes, path -> (mtime_ns, size, LineIndex)
+MAX_LINE_INDEXES = 8
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def _line_index(filename):
+    """
+    Returns the LineIndex for filename, rebuilt only if the file changed
+    """
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    with _line_indexes_lock:
+        cached = _line_indexes.pop(path, None)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            index = cached[2]
+        else:
+            if cached is not None:
+                cached[2].close()
+            index = LineIndex(path)
+        _line_indexes[path] = (st.st_mtime_ns, st.st_size, index)
+        while len(_line_indexes) > MAX_LINE_INDEXES:
+            _, (_, _, oldest) = _line_indexes.popitem(last=False)
+            oldest.close()
+        return index
+
 
-    random_lines = []
-    for x in range(quantity):
-        random_lines.append(lines[random.randint(0, quantity - 1)])
-    return random_lines
+@atexit.register
+def close_line_indexes():
+    with _line_indexes_lock:
+        while _line_indexes:
+            _, (_, _, index) = _line_indexes.popitem()
+            index.close()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,9 @@
-from web3 import Web3
 from eth_account.messages import encode_defunct
 import eth_account
 import os
 
+from signer import get_signer
+
 def sign_message(challenge, filename="secret_key.txt"):
     """
     challenge - byte string
@@ -10,19 +11,13 @@ def sign_message(challenge, filename="secret_key.txt"):
     To pass the tests, your signature must verify, and the account you use
     must have testnet funds on both the bsc and avalanche test networks.
     """
-    # This code will read your "sk.txt" file
+    # The key file is only read and the account derived on the first call
     # If the file is empty, it will raise an exception
-    with open(filename, "r") as f:
-        key = f.readlines()
-    assert(len(key) > 0), "Your account secret_key.txt is empty"
+    acct = get_signer(filename)
 
-    w3 = Web3()
     message = encode_defunct(challenge)
 
-    # TODO recover your account information for your private key and sign the given challenge
     # Use the code from the signatures assignment to sign the given challenge
-    private_key = key[0].strip()
-    acct = w3.eth.account.from_key(private_key)
     eth_addr = acct.address
     signed_message = acct.sign_message(message)
 
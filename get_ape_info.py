@@ -1,7 +1,7 @@
 from web3 import Web3
-from web3.providers.rpc import HTTPProvider
-import requests
-import json
+
+from chain_config import get_web3, load_json
+from rpc_replay import fetch_json
 
 bayc_address = "0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D"
 contract_address = Web3.to_checksum_address(bayc_address)
@@ -10,14 +10,12 @@ contract_address = Web3.to_checksum_address(bayc_address)
 # The file 'abi.json' has the ABI for the bored ape contract
 # In general, you can get contract ABIs from etherscan
 # https://api.etherscan.io/api?module=contract&action=getabi&address=0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D
-with open('ape_abi.json', 'r') as f:
-    abi = json.load(f)
+abi = load_json('ape_abi.json')
 
 ############################
 # Connect to an Ethereum node
-api_url = "https://mainnet.infura.io/v3/40fd20c85d75423692cc1eba75727f5f"  # Infura API URL
-provider = HTTPProvider(api_url)
-web3 = Web3(provider)
+# Mainnet endpoints come from chain_config (chains.json / RPC_URL_ETH)
+web3 = get_web3('eth')
 
 # Create contract instance
 contract = web3.eth.contract(address=contract_address, abi=abi)
@@ -43,11 +41,9 @@ def get_ape_info(ape_id):
         ipfs_hash = token_uri[7:]  # Remove 'ipfs://' prefix
         gateway_url = f"https://gateway.pinata.cloud/ipfs/{ipfs_hash}"
         
-        # Fetch metadata from IPFS
-        response = requests.get(gateway_url)
-        if response.status_code == 200:
-            metadata = response.json()
-            
+        # Fetch metadata from IPFS (recorded/replayed with the RPC calls, see rpc_replay)
+        metadata = fetch_json(gateway_url)
+        if metadata is not None:
             # Extract image URL
             data['image'] = metadata.get('image', '')
             
@@ -0,0 +1,108 @@
+import threading
+import time
+import weakref
+
+from web3.datastructures import AttributeDict
+
+from subscriptions import SubscriptionThread
+
+
+class HeadTracker(SubscriptionThread):
+    """
+        Keeps a chain's latest block header in memory
+
+        Headers come from eth_subscribe("newHeads") when there is a WebSocket URL,
+        otherwise from one get_block('latest') every `poll_interval` seconds,
+        shared by everything that reads the head of this chain. Readers get the
+        header with no RPC of their own (see latest_block / block_number).
+    """
+
+    subscription_type = 'newHeads'
+
+    def __init__(self, w3, ws_url=None, poll_interval=2, max_age=30, reconnect_delay=1, max_reconnect_delay=30):
+        super().__init__(ws_url, poll_interval, reconnect_delay, max_reconnect_delay)
+        self.w3 = w3
+        self.max_age = max_age
+        self.block = None
+        self.updated = None
+        self._changed = threading.Condition()
+
+    @property
+    def head(self):
+        block = self.block
+        return None if block is None else block['number']
+
+    def fresh(self):
+        """
+            True if the header is recent enough to be used instead of asking the node
+        """
+        return self.updated is not None and time.monotonic() - self.updated <= self.max_age
+
+    def wait_for_block(self, number, timeout=None):
+        """
+            Blocks until the head reaches `number`, returns the head (None if never seen)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.head is not None and self.head >= number, timeout)
+            return self.head
+
+    def poll(self):
+        self._set(self.w3.eth.get_block('latest'))
+
+    def on_message(self, header):
+        self._set(header)
+
+    def _set(self, block):
+        if not isinstance(block, AttributeDict):
+            block = AttributeDict(block)
+        with self._changed:
+            self.block = block
+            self.updated = time.monotonic()
+            self._changed.notify_all()
+
+
+_trackers = weakref.WeakKeyDictionary()
+_trackers_lock = threading.Lock()
+
+
+def get_head_tracker(w3, ws_url=None, poll_interval=2, **kwargs):
+    """
+        The one HeadTracker for w3, started (and primed with the current head)
+        on first use. Later calls return the same tracker and ignore the arguments
+    """
+    with _trackers_lock:
+        tracker = _trackers.get(w3)
+        if tracker is None:
+            tracker = HeadTracker(w3, ws_url, poll_interval, **kwargs)
+            tracker.poll()
+            tracker.start()
+            _trackers[w3] = tracker
+        return tracker
+
+
+def latest_block(w3):
+    """
+        The latest header: from w3's head tracker if it has a fresh one, else from the node
+    """
+    tracker = _trackers.get(w3)
+    if tracker is not None and tracker.fresh():
+        return tracker.block
+    return w3.eth.get_block('latest')
+
+
+def known_block_number(w3):
+    """
+        The latest block number if w3's head tracker has a fresh one, else None (never asks the node)
+    """
+    tracker = _trackers.get(w3)
+    return tracker.head if tracker is not None and tracker.fresh() else None
+
+
+def block_number(w3):
+    """
+        The latest block number: from w3's head tracker if it has a fresh one, else from the node
+    """
+    tracker = _trackers.get(w3)
+    if tracker is not None and tracker.fresh():
+        return tracker.head
+    return w3.eth.block_number
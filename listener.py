@@ -1,11 +1,31 @@
+import functools
+import time
 from web3 import Web3
-from web3.providers.rpc import HTTPProvider
-from web3.middleware import ExtraDataToPOAMiddleware #Necessary for POA chains
 from pathlib import Path
 import json
 from datetime import datetime
 import pandas as pd
 
+from chain_config import get_web3
+from head_tracker import block_number, known_block_number
+from metrics import Counter, Gauge, Histogram
+from structured_logging import get_logger
+
+
+DEPOSIT_ABI = json.loads('[ { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "token", "type": "address" }, { "indexed": true, "internalType": "address", "name": "recipient", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "amount", "type": "uint256" } ], "name": "Deposit", "type": "event" }]')
+
+log = get_logger('listener')
+
+EVENTS_FOUND = Counter('listener_events_total', "Deposit events found by scan_blocks", ['chain'])
+SCAN_SECONDS = Histogram('listener_scan_seconds', "Time scan_blocks spends fetching events", ['chain'],
+                         buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+SCAN_LAG = Gauge('listener_scan_lag_blocks', "Blocks between the chain head and the last block scanned", ['chain'])
+
+
+@functools.lru_cache(maxsize=None)
+def deposit_contract(chain, contract_address):
+    return get_web3(chain).eth.contract(address=contract_address, abi=DEPOSIT_ABI)
+
 
 def scan_blocks(chain, start_block, end_block, contract_address, eventfile='deposit_logs.csv'):
     """
@@ -17,46 +37,33 @@ def scan_blocks(chain, start_block, end_block, contract_address, eventfile='depo
 	This function reads "Deposit" events from the specified contract, 
 	and writes information about the events to the file "deposit_logs.csv"
     """
-    if chain == 'avax':
-        api_url = f"https://api.avax-test.network/ext/bc/C/rpc" #AVAX C-chain testnet
-
-    if chain == 'bsc':
-        api_url = f"https://data-seed-prebsc-1-s1.binance.org:8545/" #BSC testnet
-
-    if chain in ['avax','bsc']:
-        w3 = Web3(Web3.HTTPProvider(api_url))
-        # inject the poa compatibility middleware to the innermost layer
-        w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-    else:
-        w3 = Web3(Web3.HTTPProvider(api_url))
+    # Endpoints (and the POA middleware) come from chain_config, and the
+    # connection and contract object are reused by later calls
+    w3 = get_web3(chain)
 
-    DEPOSIT_ABI = json.loads('[ { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "token", "type": "address" }, { "indexed": true, "internalType": "address", "name": "recipient", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "amount", "type": "uint256" } ], "name": "Deposit", "type": "event" }]')
-    contract = w3.eth.contract(address=contract_address, abi=DEPOSIT_ABI)
+    contract = deposit_contract(chain, contract_address)
 
     arg_filter = {}
 
-    if start_block == "latest":
-        start_block = w3.eth.get_block_number()
-    if end_block == "latest":
-        end_block = w3.eth.get_block_number()
+    latest = None
+    if "latest" in (start_block, end_block):
+        latest = block_number(w3)
+        start_block = latest if start_block == "latest" else start_block
+        end_block = latest if end_block == "latest" else end_block
 
     if end_block < start_block:
-        print( f"Error end_block < start_block!" )
-        print( f"end_block = {end_block}" )
-        print( f"start_block = {start_block}" )
+        log.error("end_block < start_block", extra={'chain': chain, 'from_block': start_block, 'to_block': end_block})
 
-    if start_block == end_block:
-        print( f"Scanning block {start_block} on {chain}" )
-    else:
-        print( f"Scanning blocks {start_block} - {end_block} on {chain}" )
+    log.info("Scanning blocks", extra={'chain': chain, 'from_block': start_block, 'to_block': end_block})
 
     # List to store all events data
     all_events_data = []
+    scan_started = time.perf_counter()
 
     if end_block - start_block < 30:
         event_filter = contract.events.Deposit.create_filter(from_block=start_block,to_block=end_block,argument_filters=arg_filter)
         events = event_filter.get_all_entries()
-        print( f"Got {len(events)} entries for blocks {start_block}-{end_block}" )
+        log.debug("Got entries", extra={'chain': chain, 'from_block': start_block, 'to_block': end_block, 'count': len(events)})
         
         # Process events
         for evt in events:
@@ -74,7 +81,7 @@ def scan_blocks(chain, start_block, end_block, contract_address, eventfile='depo
         for block_num in range(start_block,end_block+1):
             event_filter = contract.events.Deposit.create_filter(from_block=block_num,to_block=block_num,argument_filters=arg_filter)
             events = event_filter.get_all_entries()
-            print( f"Got {len(events)} entries for block {block_num}" )
+            log.debug("Got entries", extra={'chain': chain, 'block': block_num, 'count': len(events)})
             
             # Process events for this block
             for evt in events:
@@ -89,13 +96,21 @@ def scan_blocks(chain, start_block, end_block, contract_address, eventfile='depo
                 }
                 all_events_data.append(data)
 
+    SCAN_SECONDS.labels(chain).observe(time.perf_counter() - scan_started)
+    EVENTS_FOUND.labels(chain).inc(len(all_events_data))
+    # Only when the head is known without another RPC (a head tracker, or "latest" was asked for)
+    head = known_block_number(w3)
+    head = head if head is not None else latest
+    if head is not None:
+        SCAN_LAG.labels(chain).set(max(0, head - end_block))
+
     # Create DataFrame and write to CSV
     if all_events_data:
         df = pd.DataFrame(all_events_data)
         df.to_csv(eventfile, index=False)
-        print(f"Wrote {len(all_events_data)} events to {eventfile}")
+        log.info("Wrote events", extra={'chain': chain, 'count': len(all_events_data), 'file': eventfile})
     else:
-        print("No events found in the specified block range")
+        log.info("No events found in the specified block range", extra={'chain': chain})
         # Create empty CSV with headers if no events found
         empty_df = pd.DataFrame(columns=['chain', 'token', 'recipient', 'amount', 'transactionHash', 'address', 'date'])
         empty_df.to_csv(eventfile, index=False)
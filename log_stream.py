@@ -0,0 +1,72 @@
+import queue
+
+from head_tracker import block_number
+from subscriptions import SubscriptionThread
+
+
+class LogStream(SubscriptionThread):
+    """
+        Delivers one contract event's logs to the `events` queue as soon as the node has them
+
+        With a WebSocket URL the logs come from eth_subscribe("logs"). Whenever the
+        subscription is (re)established, the blocks since the last delivered log
+        are backfilled with eth_getLogs over the event's HTTP Web3, so nothing
+        emitted while disconnected is lost. Without a WebSocket URL, or while it
+        can't connect, logs are polled with eth_getLogs every `poll_interval`
+        seconds and the WebSocket is retried with exponential backoff.
+
+        Events are decoded like filter entries (args, blockNumber, logIndex...).
+        Backfills overlap the live feed, so the consumer must ignore duplicates
+        (ConfirmationTracker.add does). Logs removed by a reorg are skipped, the
+        consumer's own reorg check drops their events.
+    """
+
+    subscription_type = 'logs'
+
+    def __init__(self, event, ws_url=None, from_block=None, poll_interval=5, chunk_size=1000,
+                 reconnect_delay=1, max_reconnect_delay=30, events=None):
+        super().__init__(ws_url, poll_interval, reconnect_delay, max_reconnect_delay)
+        self.event = event
+        self.w3 = event.w3
+        self.filter = {'address': event.address, 'topics': [event.topic]}
+        self.chunk_size = chunk_size
+        self.events = events if events is not None else queue.Queue()
+        # Backfills restart at this block (inclusive, in case it was only partly delivered)
+        self.next_block = from_block if from_block is not None else block_number(self.w3) + 1
+
+    def rewind(self, block):
+        """
+            Makes the next backfill start at `block` again (e.g. after a reorg)
+        """
+        self.next_block = min(self.next_block, block)
+
+    def subscription_arg(self):
+        return self.filter
+
+    def on_message(self, log):
+        if log.get('removed'):
+            return
+        self._deliver([log])
+        self.next_block = max(self.next_block, log['blockNumber'])
+
+    def poll(self):
+        return self.backfill()
+
+    def backfill(self):
+        """
+            Fetches the logs from next_block up to the current head over HTTP
+            Returns the number of events delivered
+        """
+        head = block_number(self.w3)
+        delivered = 0
+        while self.next_block <= head:
+            end_block = min(head, self.next_block + self.chunk_size - 1)
+            logs = self.w3.eth.get_logs({**self.filter, 'fromBlock': self.next_block, 'toBlock': end_block})
+            delivered += self._deliver(logs)
+            self.next_block = end_block + 1
+        return delivered
+
+    def _deliver(self, logs):
+        for log in logs:
+            self.events.put(self.event.process_log(log))
+        return len(logs)
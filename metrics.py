@@ -0,0 +1,257 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Prometheus' default buckets, in seconds (suits RPC calls)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """
+        The metrics exposed together on one /metrics page
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """
+            Every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Where metrics go unless they are given a registry of their own
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """
+            Reads the value from function() whenever the metrics are scraped
+        """
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.upper_bounds = buckets
+        # Per bucket (not cumulative) so observe() only touches one of them
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Metric:
+    """
+        A named metric with one value per combination of label values
+        labels(*values) returns the value for one combination (cached, so it's
+        cheap enough for hot paths), metrics without labels are used directly
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+        self._default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(child.value)}" for key, child in self._items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(child.get())}" for key, child in self._items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        lines = []
+        for key, child in self._items():
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % _number(upper_bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't print a line for every scrape
+        pass
+
+
+def start_metrics_server(port=9100, addr='127.0.0.1', registry=None):
+    """
+        Serves the registry on http://addr:port/metrics from a background thread
+        Returns the server (call shutdown() to stop it)
+    """
+    handler = type('Handler', (MetricsHandler,), {'registry': registry or REGISTRY})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
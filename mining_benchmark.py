@@ -0,0 +1,187 @@
+#!/bin/python
+import argparse
+import functools
+import hashlib
+import json
+import random
+import statistics
+import string
+import time
+
+from findBlockNonce import mine_block, mine_block_parallel
+
+
+def reference_mine_block(k, prev_hash, transactions):
+    """
+        The original mine_block hot loop, kept here as the "before" baseline
+        It rehashes prev_hash + transactions + nonce from scratch for every nonce
+        and checks the trailing bits by converting the digest to an int
+    """
+    transactions_bytes = b''
+    for transaction in transactions:
+        transactions_bytes += transaction.encode('utf-8')
+
+    mask = (1 << k) - 1
+
+    nonce = 0
+    while True:
+        nonce_bytes = str(nonce).encode('utf-8')
+        combined_data = prev_hash + transactions_bytes + nonce_bytes
+        hash_result = hashlib.sha256(combined_data).digest()
+        hash_int = int.from_bytes(hash_result, byteorder='big')
+        if (hash_int & mask) == 0:
+            break
+        nonce += 1
+
+    return nonce_bytes
+
+
+def synthetic_transactions(num_lines, seed=0, line_length=64):
+    """
+        Returns num_lines random "transactions" generated from a fixed seed
+        so that every run of the benchmark mines the same block
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + ' '
+    return [''.join(rng.choice(alphabet) for _ in range(line_length)) for _ in range(num_lines)]
+
+
+def time_miner(miner, k, prev_hash, transactions, stats=None):
+    """
+        Runs miner once and returns (nonce, hashes, seconds)
+        A serial search starts at 0, so the number of hashes tried is nonce + 1,
+        miners that search in parallel report their count in `stats` (see
+        mine_block_parallel)
+    """
+    start = time.perf_counter()
+    nonce = miner(k, prev_hash, transactions)
+    elapsed = time.perf_counter() - start
+    hashes = stats['hashes'] if stats and 'hashes' in stats else int(nonce) + 1
+    return nonce, hashes, elapsed
+
+
+def compare(k=20, num_lines=10, seed=0):
+    """
+        Mines the same block with the reference loop and the current mine_block
+        and prints hashes per second for both
+    """
+    transactions = synthetic_transactions(num_lines, seed)
+    prev_hash = b'previous_block_hash_for_testing'
+
+    results = {}
+    for name, miner in [('before', reference_mine_block), ('after', mine_block)]:
+        nonce, hashes, elapsed = time_miner(miner, k, prev_hash, transactions)
+        results[name] = hashes / elapsed
+        print(f"{name:>6}: nonce={nonce.decode()} hashes={hashes} time={elapsed:.3f}s rate={results[name]:,.0f} H/s")
+
+    print(f"speedup: {results['after'] / results['before']:.2f}x")
+    return results
+
+
+def bench_case(k, num_lines, workers, trials, seed=0):
+    """
+        Mines `trials` different blocks at difficulty k with num_lines synthetic
+        transactions and returns a summary dict for that grid point
+        workers=1 uses the serial mine_block, anything else mine_block_parallel
+    """
+    times = []
+    rates = []
+    hashes = []
+    for trial in range(trials):
+        # Every trial gets its own block, derived from the seed, so the time
+        # to solution varies the way it does for real blocks
+        transactions = synthetic_transactions(num_lines, seed=seed * 1000003 + trial)
+        prev_hash = hashlib.sha256(f"{seed}:{trial}".encode('utf-8')).digest()
+
+        stats = {}
+        if workers == 1:
+            miner = mine_block
+        else:
+            miner = functools.partial(mine_block_parallel, workers=workers, stats=stats)
+
+        nonce, trial_hashes, elapsed = time_miner(miner, k, prev_hash, transactions, stats)
+        times.append(elapsed)
+        hashes.append(trial_hashes)
+        rates.append(trial_hashes / elapsed)
+
+    return {
+        'k': k,
+        'transactions': num_lines,
+        'workers': workers,
+        'trials': trials,
+        'hashes_per_sec': statistics.mean(rates),
+        'hashes_per_sec_stdev': statistics.pstdev(rates),
+        'time_to_solution': statistics.mean(times),
+        'time_to_solution_stdev': statistics.pstdev(times),
+        'time_to_solution_max': max(times),
+        'mean_hashes': statistics.mean(hashes),
+        'expected_hashes': 2 ** k,
+    }
+
+
+def run_grid(difficulties, tx_counts, worker_counts, trials=5, seed=0):
+    """
+        Runs bench_case over every (difficulty, transactions, workers) combination
+        and returns the list of result dicts
+    """
+    results = []
+    for k in difficulties:
+        for num_lines in tx_counts:
+            for workers in worker_counts:
+                result = bench_case(k, num_lines, workers, trials, seed)
+                results.append(result)
+                print(f"k={k:>2} txs={num_lines:>4} workers={workers:>2}: "
+                      f"{result['hashes_per_sec']:>12,.0f} H/s (+/- {result['hashes_per_sec_stdev']:,.0f})  "
+                      f"time={result['time_to_solution']:.3f}s (+/- {result['time_to_solution_stdev']:.3f}s)")
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.2):
+    """
+        Compares hashes/sec against a previous run and returns the grid points
+        that got slower by more than `tolerance` (a fraction)
+    """
+    previous = {(r['k'], r['transactions'], r['workers']): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result['k'], result['transactions'], result['workers']))
+        if old and result['hashes_per_sec'] < old['hashes_per_sec'] * (1 - tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark mine_block across difficulties, block sizes and worker counts")
+    parser.add_argument('--compare', action='store_true', help="only compare the old and new hot loop")
+    parser.add_argument('--difficulties', type=_int_list, default=[8, 12, 16, 20])
+    parser.add_argument('--transactions', type=_int_list, default=[10, 100, 1000])
+    parser.add_argument('--workers', type=_int_list, default=[1, 2, 4])
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='mining_bench.json', help="where to write the results as JSON")
+    parser.add_argument('--baseline', help="results file from an earlier run to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare()
+        raise SystemExit(0)
+
+    results = run_grid(args.difficulties, args.transactions, args.workers, args.trials, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump({'seed': args.seed, 'trials': args.trials, 'results': results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result, old in regressions:
+            print(f"REGRESSION: k={result['k']} txs={result['transactions']} workers={result['workers']} "
+                  f"{old['hashes_per_sec']:,.0f} -> {result['hashes_per_sec']:,.0f} H/s")
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,118 @@
+import eth_abi
+from web3.exceptions import ContractLogicError
+
+from structured_logging import get_logger
+
+
+# What require(condition, "reason") reverts with: Error(string)
+ERROR_SELECTOR = '0x08c379a0'
+
+# What failed asserts, overflows, out of bounds indexes... revert with: Panic(uint256)
+PANIC_SELECTOR = '0x4e487b71'
+PANIC_CODES = {
+    0x01: 'assertion failed',
+    0x11: 'arithmetic overflow or underflow',
+    0x12: 'division by zero',
+    0x21: 'invalid enum value',
+    0x22: 'invalid storage byte array',
+    0x31: 'pop on an empty array',
+    0x32: 'array index out of bounds',
+    0x41: 'out of memory',
+    0x51: 'call to an uninitialized function',
+}
+
+# JSON-RPC error code geth (and most nodes since) answer a reverted eth_call with
+REVERT_CODE = 3
+
+log = get_logger('preflight')
+
+
+class RelayReverted(Exception):
+    """
+        A relay whose simulation reverted, so it was never broadcast
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"Simulation reverted: {reason}")
+        self.reason = reason
+
+
+def decode_revert(data):
+    """
+        The reason in a call's revert data: the require() message, the Panic
+        code, or the selector of a custom error
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = '0x' + bytes(data).hex()
+    if not data or data == '0x':
+        return "reverted without a reason"
+    data = data.lower() if data.startswith('0x') else '0x' + data.lower()
+    try:
+        if data.startswith(ERROR_SELECTOR):
+            return eth_abi.decode(['string'], bytes.fromhex(data[10:]))[0]
+        if data.startswith(PANIC_SELECTOR):
+            code = eth_abi.decode(['uint256'], bytes.fromhex(data[10:]))[0]
+            return f"Panic(0x{code:02x}): {PANIC_CODES.get(code, 'unknown panic code')}"
+    except Exception:
+        pass
+    return f"custom error {data[:10]}"
+
+
+def _revert_reason(message, data):
+    if isinstance(data, str) and data.startswith('0x') and len(data) >= 10:
+        return decode_revert(data)
+    # Nodes that don't return the data put the reason in the message
+    message = str(message or '')
+    _, _, reason = message.partition('execution reverted: ')
+    return reason or message or "reverted without a reason"
+
+
+def _response_reason(response):
+    """
+        Revert reason of a raw eth_call response, None if it didn't revert
+    """
+    error = response.get('error') if isinstance(response, dict) else None
+    if not error:
+        return None
+    message = error.get('message', '')
+    if error.get('code') != REVERT_CODE and 'revert' not in message.lower():
+        # The node failed to run the call (rate limited, missing state...),
+        # which says nothing about the transaction itself
+        log.warning("Simulation failed", extra={'error': message})
+        return None
+    return _revert_reason(message, error.get('data'))
+
+
+def _call_reason(w3, tx, block):
+    try:
+        w3.eth.call(tx, block)
+    except ContractLogicError as e:
+        return _revert_reason(e.message, e.data)
+    except Exception as e:
+        # Some providers raise their own exception type for a revert
+        if 'revert' in str(e).lower():
+            return _revert_reason(str(e), None)
+        log.warning("Simulation failed", extra={'error': str(e)})
+    return None
+
+
+def simulate(w3, calls, sender, block='pending'):
+    """
+        Runs contract calls (e.g. contract.functions.wrap(...)) with eth_call as
+        `sender` at `block`, all in one JSON-RPC batch where the endpoint takes it
+        Returns the revert reason of each call in order, None for the calls that
+        would succeed (or that the node couldn't run, those are left to the chain)
+    """
+    if not calls:
+        return []
+    txs = [{'from': sender, 'to': call.address, 'data': call._encode_transaction_data()} for call in calls]
+    try:
+        # Raw responses (through the middleware), so one revert doesn't fail the whole batch
+        make_batch_request = w3.provider.batch_request_func(w3, w3.middleware_onion)
+        responses = make_batch_request([('eth_call', [tx, block]) for tx in txs])
+    except Exception as e:
+        responses = e
+    if isinstance(responses, list) and len(responses) == len(txs):
+        return [_response_reason(response) for response in responses]
+    log.warning("Batched simulation failed, falling back to individual calls", extra={'error': str(responses)})
+    return [_call_reason(w3, tx, block) for tx in txs]
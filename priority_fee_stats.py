@@ -0,0 +1,236 @@
+#!/bin/python
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from reading_the_chain import priority_fees
+from structured_logging import get_logger
+
+
+# Transaction types counted per block (legacy, access list, EIP-1559, blob, set code),
+# anything newer goes to txs_other
+TX_TYPES = (0, 1, 2, 3, 4)
+
+# Columns of every part file, in order, with their dtypes
+# Fees are in wei, saturated to the int64 range (no real priority fee comes near it)
+COLUMNS = {
+    'block': np.int64,
+    'timestamp': np.int64,
+    'base_fee': np.int64,
+    'tx_count': np.int32,
+    'inversions': np.int64,
+    'fee_min': np.int64,
+    'fee_median': np.int64,
+    'fee_max': np.int64,
+    **{f'txs_type{tx_type}': np.int32 for tx_type in TX_TYPES},
+    'txs_other': np.int32,
+}
+
+# Blocks per part file: parts are aligned to multiples of this, so reruns over
+# overlapping ranges find the parts that are already done
+CHUNK_SIZE = 10000
+
+PART_NAME = re.compile(r'fees_(\d+)_(\d+)\.npz')
+
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_MAX = np.iinfo(np.int64).max
+
+log = get_logger('priority_fee_stats')
+
+
+def count_inversions(values):
+    """
+        Number of pairs i < j with values[i] < values[j], i.e. how many swaps a
+        list sorted in decreasing order (what is_ordered_block checks) is away
+        from that order: 0 when sorted, n * (n - 1) / 2 when fully reversed
+        Merge sort, so O(n log n)
+    """
+    values = list(values)
+    inversions = 0
+    width = 1
+    while width < len(values):
+        merged = []
+        for lo in range(0, len(values), 2 * width):
+            left = values[lo:lo + width]
+            right = values[lo + width:lo + 2 * width]
+            i = j = 0
+            while i < len(left) and j < len(right):
+                if left[i] >= right[j]:
+                    merged.append(left[i])
+                    i += 1
+                else:
+                    # right[j] pays more than everything still waiting in left
+                    inversions += len(left) - i
+                    merged.append(right[j])
+                    j += 1
+            merged.extend(left[i:])
+            merged.extend(right[j:])
+        values = merged
+        width *= 2
+    return inversions
+
+
+def _int64(value):
+    return min(max(int(value), _INT64_MIN), _INT64_MAX)
+
+
+def block_stats(block):
+    """
+        One row of COLUMNS for a block fetched with full_transactions=True
+        fee_median is the lower median, so it is always one of the block's fees
+        (all fees are 0 for a block without transactions)
+    """
+    fees = priority_fees(block)
+    ordered_fees = sorted(fees)
+    types = [int(tx.get('type', 0)) for tx in block.transactions]
+    row = {
+        'block': block.number,
+        'timestamp': block.timestamp,
+        'base_fee': _int64(block.get('baseFeePerGas', 0)),
+        'tx_count': len(fees),
+        'inversions': count_inversions(fees),
+        'fee_min': _int64(ordered_fees[0]) if fees else 0,
+        'fee_median': _int64(ordered_fees[(len(fees) - 1) // 2]) if fees else 0,
+        'fee_max': _int64(ordered_fees[-1]) if fees else 0,
+    }
+    for tx_type in TX_TYPES:
+        row[f'txs_type{tx_type}'] = types.count(tx_type)
+    row['txs_other'] = len(types) - sum(row[f'txs_type{tx_type}'] for tx_type in TX_TYPES)
+    return row
+
+
+def fetch_blocks(w3, block_numbers):
+    """
+        Full blocks for block_numbers, as one JSON-RPC batch where the endpoint takes it
+    """
+    try:
+        with w3.batch_requests() as batch:
+            for number in block_numbers:
+                batch.add(w3.eth.get_block(number, full_transactions=True))
+            return list(batch.execute())
+    except Exception as e:
+        log.warning("Batched block fetch failed, falling back to individual calls", extra={'error': str(e)})
+        return [w3.eth.get_block(number, full_transactions=True) for number in block_numbers]
+
+
+def iter_block_stats(w3, start, end, batch_size=20, workers=4):
+    """
+        Yields block_stats for every block from start to end (inclusive), in order
+        Up to `workers` batches of batch_size blocks are fetched at a time
+    """
+    batches = [range(first, min(first + batch_size, end + 1)) for first in range(start, end + 1, batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # A window of batches in flight, so a long range isn't all queued at once
+        for i in range(0, len(batches), workers):
+            for blocks in executor.map(lambda numbers: fetch_blocks(w3, numbers), batches[i:i + workers]):
+                for block in blocks:
+                    yield block_stats(block)
+
+
+def part_path(out_dir, start, end):
+    return os.path.join(out_dir, f"fees_{start:09d}_{end:09d}.npz")
+
+
+def write_part(path, rows):
+    """
+        Writes rows as one compressed array per column (written aside and
+        renamed, so a part file is either complete or missing)
+    """
+    columns = {name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in COLUMNS.items()}
+    # Hidden from load_stats' glob, in case the run dies before the rename
+    out_dir, name = os.path.split(path)
+    tmp = os.path.join(out_dir, '.tmp-' + name)
+    np.savez_compressed(tmp, **columns)
+    os.replace(tmp, path)
+
+
+def plan_parts(start, end, chunk_size=CHUNK_SIZE):
+    """
+        [(first, last), ...] covering start..end, split at multiples of chunk_size
+    """
+    parts = []
+    first = start
+    while first <= end:
+        last = min(end, (first // chunk_size + 1) * chunk_size - 1)
+        parts.append((first, last))
+        first = last + 1
+    return parts
+
+
+def analyze_blocks(w3, start, end, out_dir, chunk_size=CHUNK_SIZE, batch_size=20, workers=4, on_block=None):
+    """
+        Writes the priority fee statistics of blocks start..end to part files in
+        out_dir, one per chunk, skipping the parts that are already there (so an
+        interrupted run picks up where it stopped)
+        on_block - called with each block's row as it is computed
+        Returns the number of blocks analyzed (not counting skipped parts)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    analyzed = 0
+    for first, last in plan_parts(start, end, chunk_size):
+        path = part_path(out_dir, first, last)
+        if os.path.exists(path):
+            log.debug("Part already done", extra={'from_block': first, 'to_block': last})
+            continue
+        rows = []
+        for row in iter_block_stats(w3, first, last, batch_size, workers):
+            rows.append(row)
+            if on_block:
+                on_block(row)
+        write_part(path, rows)
+        analyzed += len(rows)
+        log.info("Wrote part", extra={'from_block': first, 'to_block': last, 'path': path})
+    return analyzed
+
+
+def load_stats(out_dir, start=None, end=None):
+    """
+        Every part in out_dir as one DataFrame sorted by block (optionally only start..end)
+    """
+    frames = []
+    for path in sorted(glob.glob(os.path.join(out_dir, 'fees_*.npz'))):
+        match = PART_NAME.fullmatch(os.path.basename(path))
+        if match is None:
+            # Not a part file, e.g. a leftover temp file from an older version
+            continue
+        first, last = map(int, match.groups())
+        if (start is not None and last < start) or (end is not None and first > end):
+            continue
+        with np.load(path) as part:
+            frames.append(pd.DataFrame({name: part[name] for name in COLUMNS}))
+    if not frames:
+        return pd.DataFrame({name: np.array([], dtype=dtype) for name, dtype in COLUMNS.items()})
+    stats = pd.concat(frames, ignore_index=True).drop_duplicates('block').sort_values('block', ignore_index=True)
+    if start is not None:
+        stats = stats[stats.block >= start]
+    if end is not None:
+        stats = stats[stats.block <= end]
+    return stats.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-block priority fee statistics (ordering, spread, tx types) for a range of blocks")
+    parser.add_argument('start', type=int)
+    parser.add_argument('end', help="last block, or 'latest'")
+    parser.add_argument('--chain', default='eth')
+    parser.add_argument('--out', default='priority_fees', help="directory of the part files (reused to resume)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="blocks per part file")
+    parser.add_argument('--batch-size', type=int, default=20, help="blocks per JSON-RPC batch")
+    parser.add_argument('--workers', type=int, default=4, help="batches fetched at a time")
+    args = parser.parse_args()
+
+    from chain_config import get_web3
+    w3 = get_web3(args.chain)
+    end = w3.eth.block_number if args.end == 'latest' else int(args.end)
+    analyze_blocks(w3, args.start, end, args.out, args.chunk_size, args.batch_size, args.workers)
+
+    stats = load_stats(args.out, args.start, end)
+    busy = stats[stats.tx_count > 1]
+    print(f"{len(stats)} blocks, {len(busy)} with 2+ transactions, "
+          f"{(busy.inversions == 0).mean() if len(busy) else float('nan'):.1%} of those ordered, "
+          f"median inversions {busy.inversions.median() if len(busy) else 0:.0f}")
@@ -0,0 +1,206 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from web3.providers.base import JSONBaseProvider
+
+from metrics import Counter, Histogram
+
+
+# JSON-RPC error codes and messages providers use for "slow down"
+# (-32005 is Infura/geth's "limit exceeded", -32090 is used by some public BSC nodes)
+RATE_LIMIT_CODES = {429, -32005, -32090}
+RATE_LIMIT_MESSAGES = ('rate limit', 'too many requests', 'limit exceeded', 'capacity exceeded', 'request rate')
+
+# HTTP statuses worth retrying on the same endpoint
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Every attempt is timed, including the ones that get retried
+RPC_SECONDS = Histogram('rpc_request_seconds', "RPC request latency by method and endpoint", ['method', 'endpoint'])
+RPC_ERRORS = Counter('rpc_errors_total', "RPC requests that failed or were rate limited", ['method', 'endpoint'])
+RPC_RETRIES = Counter('rpc_retries_total', "RPC requests retried on the same endpoint", ['endpoint'])
+RPC_THROTTLED = Counter('rpc_throttled_seconds_total', "Time spent waiting on the client-side rate limit", ['endpoint'])
+
+
+class TokenBucket:
+    """
+        Allows `rate` requests per second on average, with bursts of up to `burst`
+        acquire() reserves its tokens straight away and sleeps off any deficit,
+        so callers queue up in order instead of all waking at once
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.throttled = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+            Blocks until `tokens` requests may be sent, returns the time waited
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.throttled += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RetryBudget:
+    """
+        Caps retries across every endpoint in the process
+        Each request adds `ratio` of a retry to the budget (up to `max_tokens`),
+        and `min_per_sec` retries per second are always allowed, so when a
+        provider is failing outright retries stay a small fraction of traffic
+        instead of multiplying it
+    """
+
+    def __init__(self, ratio=0.2, min_per_sec=1.0, max_tokens=50):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_retry(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_sec)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.denied += 1
+            return False
+
+
+class RateLimitError(Exception):
+    """
+        An endpoint kept answering with a rate limit error
+    """
+
+    def __init__(self, response):
+        super().__init__(response.get('error'))
+        self.response = response
+
+
+# Shared by every RateLimitedProvider unless one is given its own
+GLOBAL_RETRY_BUDGET = RetryBudget()
+
+
+def is_rate_limited(response):
+    """
+        True if a JSON-RPC response is a provider's rate limit error
+    """
+    error = response.get('error') if isinstance(response, dict) else None
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get('message', '')).lower()
+    return error.get('code') in RATE_LIMIT_CODES or any(text in message for text in RATE_LIMIT_MESSAGES)
+
+
+def is_retryable(exc):
+    """
+        True for transport errors that are worth retrying on the same endpoint
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def _retry_after(exc):
+    # Honour the server's Retry-After (in seconds) if a 429 came with one
+    response = getattr(exc, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class RateLimitedProvider(JSONBaseProvider):
+    """
+        Wraps one endpoint's provider with a TokenBucket (if `rate` is set) and
+        retries rate limit errors and transient failures with jittered
+        exponential backoff, as long as the retry budget allows
+    """
+
+    def __init__(self, provider, rate=None, burst=None, budget=None, max_retries=5, base_delay=0.25,
+                 max_delay=10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.budget = budget or GLOBAL_RETRY_BUDGET
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        # Only the host, endpoint paths often hold an API key
+        uri = self.endpoint_uri
+        self.endpoint_label = urlparse(str(uri)).netloc or str(uri)
+
+    @property
+    def endpoint_uri(self):
+        return getattr(self.provider, 'endpoint_uri', None)
+
+    def __str__(self):
+        return f"Rate limited {self.provider}"
+
+    def backoff(self, attempt, at_least=0.0):
+        # "Full jitter": anywhere up to the exponential delay, so clients that
+        # were limited together don't all come back together
+        return max(at_least, random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def _record(self, method, start, failed):
+        RPC_SECONDS.labels(method, self.endpoint_label).observe(time.perf_counter() - start)
+        if failed:
+            RPC_ERRORS.labels(method, self.endpoint_label).inc()
+
+    def _send(self, method, send, tokens):
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                waited = self.bucket.acquire(tokens)
+                if waited:
+                    RPC_THROTTLED.labels(self.endpoint_label).inc(waited)
+            self.budget.on_request()
+            start = time.perf_counter()
+            try:
+                response = send()
+            except Exception as e:
+                self._record(method, start, True)
+                if not is_retryable(e) or attempt >= self.max_retries or not self.budget.try_retry():
+                    raise
+                delay = self.backoff(attempt, _retry_after(e))
+            else:
+                limited = is_rate_limited(response) if isinstance(response, dict) \
+                    else any(is_rate_limited(r) for r in response)
+                self._record(method, start, limited)
+                if not limited or attempt >= self.max_retries or not self.budget.try_retry():
+                    return response
+                delay = self.backoff(attempt)
+            self.retries += 1
+            RPC_RETRIES.labels(self.endpoint_label).inc()
+            attempt += 1
+            time.sleep(delay)
+
+    def make_request(self, method, params):
+        return self._send(method, lambda: self.provider.make_request(method, params), 1)
+
+    def make_batch_request(self, batch_requests):
+        # Providers count every call in a batch against the limit
+        return self._send('batch', lambda: self.provider.make_batch_request(batch_requests), len(batch_requests))
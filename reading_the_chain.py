@@ -1,8 +1,7 @@
 import random
-import json
 from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware
-from web3.providers.rpc import HTTPProvider
+
+from chain_config import get_web3, load_json
 
 
 # If you use one of the suggested infrastructure providers, the url will be of the form
@@ -11,28 +10,23 @@ from web3.providers.rpc import HTTPProvider
 # infura_url = f"https://mainnet.infura.io/v3/{infura_token}"
 
 def connect_to_eth():
-	# Using the Infura URL from the API key file
-	url = "https://mainnet.infura.io/v3/40fd20c85d75423692cc1eba75727f5f"
-	w3 = Web3(HTTPProvider(url))
-	assert w3.is_connected(), f"Failed to connect to provider at {url}"
+	# Mainnet endpoints come from chain_config (chains.json / RPC_URL_ETH)
+	w3 = get_web3('eth')
+	assert w3.is_connected(), f"Failed to connect to provider at {w3.provider.endpoint_uri}"
 	return w3
 
 
 def connect_with_middleware(contract_json):
 	# Load contract information
-	with open(contract_json, "r") as f:
-		d = json.load(f)
-		d = d['bsc']
-		address = d['address']
-		abi = d['abi']
-
-	# Connect to BNB testnet
-	bnb_url = "https://data-seed-prebsc-1-s1.binance.org:8545/"
-	w3 = Web3(HTTPProvider(bnb_url))
-	w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+	d = load_json(contract_json)['bsc']
+	address = d['address']
+	abi = d['abi']
+
+	# Connect to BNB testnet (chain_config adds the POA middleware)
+	w3 = get_web3('bsc')
 	
 	# Verify connection
-	assert w3.is_connected(), f"Failed to connect to BNB provider at {bnb_url}"
+	assert w3.is_connected(), f"Failed to connect to BNB provider at {w3.provider.endpoint_uri}"
 
 	# Create contract object
 	contract = w3.eth.contract(address=address, abi=abi)
@@ -40,6 +34,33 @@ def connect_with_middleware(contract_json):
 	return w3, contract
 
 
+def priority_fee(tx, base_fee_per_gas):
+	"""
+	The priority fee (tip per gas) a transaction pays in a block with the given base fee
+	"""
+	# Check if this is a type 2 transaction (has maxPriorityFeePerGas)
+	if hasattr(tx, 'maxPriorityFeePerGas') and tx.maxPriorityFeePerGas is not None:
+		# Type 2 transaction
+		max_priority_fee = tx.maxPriorityFeePerGas
+		max_fee = tx.maxFeePerGas if hasattr(tx, 'maxFeePerGas') and tx.maxFeePerGas is not None else tx.gasPrice
+		return min(max_priority_fee, max_fee - base_fee_per_gas)
+	# Type 0 transaction (legacy)
+	if base_fee_per_gas > 0:
+		# Post EIP-1559, priority fee = gasPrice - baseFeePerGas
+		return tx.gasPrice - base_fee_per_gas
+	# Pre EIP-1559, priority fee = gasPrice
+	return tx.gasPrice
+
+
+def priority_fees(block):
+	"""
+	The priority fees of a block's transactions, in block order
+	(the block must have been fetched with full_transactions=True)
+	"""
+	base_fee_per_gas = block.get('baseFeePerGas', 0)
+	return [priority_fee(tx, base_fee_per_gas) for tx in block.transactions]
+
+
 def is_ordered_block(w3, block_num):
 	"""
 	Takes a block number
@@ -52,6 +73,8 @@ def is_ordered_block(w3, block_num):
 		*Type 2* The priority fee is min( tx.maxPriorityFeePerGas, tx.maxFeePerGas - block.baseFeePerGas )
 
 	Conveniently, most type 2 transactions set the gasPrice field to be min( tx.maxPriorityFeePerGas + block.baseFeePerGas, tx.maxFeePerGas )
+
+	priority_fee_stats.py keeps the whole fee vector of many blocks, for studies beyond this yes/no
 	"""
 	block = w3.eth.get_block(block_num, full_transactions=True)
 	ordered = False
@@ -64,29 +87,10 @@ def is_ordered_block(w3, block_num):
 		ordered = True
 	else:
 		# Calculate priority fees for all transactions
-		priority_fees = []
-		base_fee_per_gas = block.get('baseFeePerGas', 0)
-		
-		for tx in transactions:
-			# Check if this is a type 2 transaction (has maxPriorityFeePerGas)
-			if hasattr(tx, 'maxPriorityFeePerGas') and tx.maxPriorityFeePerGas is not None:
-				# Type 2 transaction
-				max_priority_fee = tx.maxPriorityFeePerGas
-				max_fee = tx.maxFeePerGas if hasattr(tx, 'maxFeePerGas') and tx.maxFeePerGas is not None else tx.gasPrice
-				priority_fee = min(max_priority_fee, max_fee - base_fee_per_gas)
-			else:
-				# Type 0 transaction (legacy)
-				if base_fee_per_gas > 0:
-					# Post EIP-1559, priority fee = gasPrice - baseFeePerGas
-					priority_fee = tx.gasPrice - base_fee_per_gas
-				else:
-					# Pre EIP-1559, priority fee = gasPrice
-					priority_fee = tx.gasPrice
-			
-			priority_fees.append(priority_fee)
+		fees = priority_fees(block)
 		
 		# Check if the priority fees are in decreasing order
-		ordered = all(priority_fees[i] >= priority_fees[i+1] for i in range(len(priority_fees)-1))
+		ordered = all(fees[i] >= fees[i+1] for i in range(len(fees)-1))
 
 	return ordered
 
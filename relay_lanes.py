@@ -0,0 +1,438 @@
+import heapq
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from fee_oracle import get_fee_oracle
+from preflight import RelayReverted, simulate
+from structured_logging import get_logger
+from tx_watchdog import bump_fees, event_id
+
+
+# Contract entry points that relay many events in one transaction
+BATCH_FUNCTIONS = {'wrap': 'batchWrap', 'withdraw': 'batchWithdraw'}
+
+# Quarantined jobs kept around for inspection (the oldest are forgotten first)
+MAX_QUARANTINED = 1000
+
+# Failed relays are built again with a fresh nonce up to MAX_ATTEMPTS times,
+# RETRY_DELAY seconds after the first failure, doubling after each one
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 2
+
+# Fee bump for a filler that has to replace a transaction the node may have taken
+FILLER_BUMP = 1.125
+
+log = get_logger('relay_lanes')
+
+
+def _already_known(error):
+    # The node has this exact transaction in its pool already
+    message = str(error).lower()
+    return 'already known' in message or 'known transaction' in message
+
+
+class RelayJob:
+    """
+        One relay to make: contract.function(*args) for a bridge event
+        lane is the token the event is for, relays for one token stay in order
+        Batched jobs (see batch_jobs) carry all the events they relay in `events`
+        done is set once the job is out of the engine's hands (broadcast, quarantined,
+        or failed on every attempt)
+    """
+
+    def __init__(self, contract, function, args, event, lane):
+        self.contract = contract
+        self.function = function
+        self.args = args
+        self.event = event
+        self.events = [event] if event is not None else []
+        self.batch_size = None
+        self.lane = lane
+        self.nonce = None
+        self.tx = None
+        self.tx_hash = None
+        self.error = None
+        self.attempts = 0
+        self.done = threading.Event()
+
+
+def batch_jobs(jobs, max_batch=50):
+    """
+        Merges wrap/withdraw jobs for the same contract into batchWrap/batchWithdraw
+        jobs of up to max_batch events each, keeping the events in their original order
+        Anything that can't be batched (or would be a batch of one) is returned as is
+    """
+    groups = OrderedDict()
+    for job in jobs:
+        groups.setdefault((id(job.contract), job.function), []).append(job)
+
+    batched = []
+    for (_, function), group in groups.items():
+        if function not in BATCH_FUNCTIONS:
+            batched.extend(group)
+            continue
+        for i in range(0, len(group), max_batch):
+            chunk = group[i:i + max_batch]
+            if len(chunk) == 1:
+                batched.extend(chunk)
+                continue
+            # [(token, recipient, amount), ...] -> ([tokens], [recipients], [amounts])
+            args = tuple(list(column) for column in zip(*[job.args for job in chunk]))
+            job = RelayJob(chunk[0].contract, BATCH_FUNCTIONS[function], args, None, 'batch')
+            job.events = [j.event for j in chunk]
+            job.batch_size = len(chunk)
+            batched.append(job)
+    return batched
+
+
+class OrderedSubmitter(threading.Thread):
+    """
+        The only place transactions for one (chain, sender) get nonces and get broadcast
+
+        Lanes call next_nonce() once their transaction is built, sign it, and hand
+        it back with submit(). Transactions can come back in any order, but are
+        broadcast strictly in nonce order, so the node never sees a nonce gap.
+        A nonce whose transaction couldn't be signed or sent is filled with a
+        0-value transfer to ourselves, so later nonces aren't stuck behind it.
+
+        The nonce is read from the node once, and again whenever the node says
+        it is out of step: nonces it has already seen (something else sent from
+        the account) are dropped and the jobs holding them handed back, and
+        relays it has lost are broadcast again from the watchdog's copy.
+        Jobs that didn't go out are passed to on_failed, to be built again
+        with a fresh nonce (without on_failed they are just marked done).
+    """
+
+    def __init__(self, w3, signer, watchdog=None, on_sent=None, on_failed=None):
+        super().__init__(daemon=True)
+        self.w3 = w3
+        self.signer = signer
+        self.watchdog = watchdog
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self.chain_id = w3.eth.chain_id
+        self._next_nonce = w3.eth.get_transaction_count(signer.address, 'pending')
+        self._next_to_send = self._next_nonce
+        self._heap = []
+        self._stopped = False
+
+    def next_nonce(self):
+        with self._lock:
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            return nonce
+
+    def submit(self, nonce, signed_txn, job):
+        with self._ready:
+            if nonce >= self._next_to_send:
+                heapq.heappush(self._heap, (nonce, signed_txn, job))
+                self._ready.notify()
+                return
+        # Handed out before a resync moved past it
+        self._failed(job)
+
+    def skip(self, nonce, job=None):
+        """
+            Give up a nonce that won't get its transaction (it gets a filler instead)
+        """
+        self.submit(nonce, None, job)
+
+    def stop(self):
+        with self._ready:
+            self._stopped = True
+            self._ready.notify()
+
+    def run(self):
+        while True:
+            with self._ready:
+                while not self._stopped and not (self._heap and self._heap[0][0] == self._next_to_send):
+                    self._ready.wait()
+                if self._stopped:
+                    return
+                nonce, signed_txn, job = heapq.heappop(self._heap)
+            self._send(nonce, signed_txn, job)
+            with self._lock:
+                self._next_to_send = max(self._next_to_send, nonce + 1)
+
+    def _send(self, nonce, signed_txn, job):
+        if signed_txn is None:
+            self._fill_gap(nonce)
+            self._failed(job)
+            return
+        try:
+            job.tx_hash = self._broadcast(nonce, signed_txn)
+        except Exception as e:
+            job.error = e
+            log.error("Failed to send relay", extra={'function': job.function, 'nonce': nonce, 'error': str(e)})
+            if 'nonce too low' in str(e).lower():
+                # The nonce is used already, so there is no gap to fill
+                self.resync()
+                self._failed(job)
+            elif self._fill_gap(nonce, job.tx):
+                # The filler took the nonce, so the relay can't land any more
+                self._failed(job)
+            elif self.watchdog is not None:
+                # The node may have taken the relay after all, and building it
+                # again could relay the event twice. Watched instead, it either
+                # gets mined, is re-sent when it looks stuck, or shows up as dropped
+                job.tx_hash = signed_txn.hash
+                self._sent(job)
+            else:
+                job.done.set()
+            return
+        job.error = None
+        self._sent(job)
+
+    def _sent(self, job):
+        if self.watchdog is not None:
+            self.watchdog.track(self.w3, self.signer, job.tx, job.tx_hash, [event_id(e) for e in job.events], job)
+        if self.on_sent:
+            self.on_sent(job)
+        job.done.set()
+
+    def _broadcast(self, nonce, signed_txn):
+        try:
+            return self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        except Exception as e:
+            if _already_known(e):
+                return signed_txn.hash
+            if 'nonce too high' not in str(e).lower():
+                raise
+        # The node lost earlier transactions of ours (evicted, or we failed over
+        # to another node): send them again from its nonce up, then this one
+        for missing in range(self.resync(), nonce):
+            self._resend(missing)
+        return self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+
+    def _resend(self, nonce):
+        """
+            Re-broadcasts the relay the watchdog is tracking for nonce, or fills
+            the nonce if nothing is (or the relay is refused, the watchdog then
+            reports it as dropped)
+        """
+        tracked = self.watchdog.find(self.w3, self.signer.address, nonce) if self.watchdog is not None else None
+        if tracked is not None:
+            try:
+                self.w3.eth.send_raw_transaction(tracked.signer.sign_transaction(tracked.tx).raw_transaction)
+                log.info("Re-sent relay the node lost", extra={'nonce': nonce, 'tx_hash': tracked.tx_hash})
+                return
+            except Exception as e:
+                if _already_known(e):
+                    return
+                log.error("Failed to re-send relay", extra={'nonce': nonce, 'error': str(e)})
+        self._fill_gap(nonce)
+
+    def resync(self):
+        """
+            Re-reads the account's pending nonce from the node and moves the
+            next nonce to send (and to hand out) to it, dropping queued
+            transactions whose nonce the node has already seen
+            Returns the node's pending nonce
+        """
+        pending = self.w3.eth.get_transaction_count(self.signer.address, 'pending')
+        with self._lock:
+            stale = [entry for entry in self._heap if entry[0] < pending]
+            self._heap = [entry for entry in self._heap if entry[0] >= pending]
+            heapq.heapify(self._heap)
+            if pending != self._next_to_send:
+                log.warning("Nonce resynced", extra={'from_nonce': self._next_to_send, 'nonce': pending})
+            self._next_to_send = pending
+            self._next_nonce = max(self._next_nonce, pending)
+        for _, _, job in stale:
+            self._failed(job)
+        return pending
+
+    def _failed(self, job):
+        if job is None:
+            return
+        if self.on_failed:
+            self.on_failed(job)
+        else:
+            job.done.set()
+
+    def _fill_gap(self, nonce, replacing=None):
+        """
+            Sends a no-op transaction with `nonce`, with fees high enough to
+            replace the `replacing` transaction if the node did take it
+            Returns True if the node accepted it
+        """
+        fees = get_fee_oracle(self.w3).fee_fields()
+        if replacing is not None:
+            fees = bump_fees(replacing, fees, FILLER_BUMP)
+        tx = {
+            'from': self.signer.address,
+            'to': self.signer.address,
+            'value': 0,
+            'gas': 21000,
+            'nonce': nonce,
+            'chainId': self.chain_id,
+            **fees,
+        }
+        try:
+            tx_hash = self.w3.eth.send_raw_transaction(self.signer.sign_transaction(tx).raw_transaction)
+            log.info("Filled nonce with a no-op transaction", extra={'nonce': nonce, 'tx_hash': tx_hash})
+            return True
+        except Exception as e:
+            log.error("Failed to fill nonce", extra={'nonce': nonce, 'error': str(e)})
+            return False
+
+
+class RelayEngine:
+    """
+        Relays bridge events on several lanes at once
+
+        Events are grouped by token, each token is a lane, and up to `lanes` lanes
+        build and sign their transactions in parallel threads (a burst of deposits
+        for one token doesn't hold up another token's users). Each chain has one
+        OrderedSubmitter that hands out nonces and broadcasts in nonce order.
+        preflight() weeds out the jobs that would revert before they get that far.
+        Jobs that fail to build or send are retried with a fresh nonce (so a
+        retried relay can land after later ones from its lane); after
+        MAX_ATTEMPTS their error is kept and they go to on_failed.
+    """
+
+    def __init__(self, signer, watchdog=None, lanes=4, on_sent=None, on_quarantined=None, on_failed=None):
+        self.signer = signer
+        self.watchdog = watchdog
+        self.on_sent = on_sent
+        self.on_quarantined = on_quarantined
+        self.on_failed = on_failed
+        self.quarantined = deque(maxlen=MAX_QUARANTINED)
+        self._executor = ThreadPoolExecutor(max_workers=lanes, thread_name_prefix='relay-lane')
+        self._submitters = {}
+        self._lock = threading.Lock()
+
+    def submitter(self, w3):
+        with self._lock:
+            submitter = self._submitters.get(id(w3))
+            if submitter is None:
+                submitter = OrderedSubmitter(w3, self.signer, self.watchdog, self.on_sent, self.retry)
+                submitter.start()
+                self._submitters[id(w3)] = submitter
+            return submitter
+
+    def preflight(self, jobs):
+        """
+            Simulates every job with eth_call at the pending block (one batch per
+            chain) and returns the ones that would go through
+            Jobs that would revert are quarantined instead: their error is set to
+            a RelayReverted with the decoded reason, they are kept in
+            self.quarantined and handed to on_quarantined, and never get a nonce
+            Each job is simulated on its own, so jobs that only fail because of
+            an earlier one in the same round (e.g. two withdrawals that together
+            exceed the balance) still get through and revert on chain
+        """
+        chains = OrderedDict()
+        for job in jobs:
+            chains.setdefault(id(job.contract.w3), []).append(job)
+
+        runnable = []
+        for chain_jobs in chains.values():
+            calls = [getattr(job.contract.functions, job.function)(*job.args) for job in chain_jobs]
+            reasons = simulate(chain_jobs[0].contract.w3, calls, self.signer.address)
+            for job, reason in zip(chain_jobs, reasons):
+                if reason is None:
+                    runnable.append(job)
+                    continue
+                job.error = RelayReverted(reason)
+                job.done.set()
+                self.quarantined.append(job)
+                if self.on_quarantined:
+                    self.on_quarantined(job)
+        # Back in the order they came in, so lanes keep their events in order
+        order = {id(job): i for i, job in enumerate(jobs)}
+        return sorted(runnable, key=lambda job: order[id(job)])
+
+    def relay(self, jobs):
+        """
+            Relays a list of RelayJobs, returns once every transaction has been
+            signed and queued for broadcast (broadcasts finish in the background)
+        """
+        lanes = OrderedDict()
+        for job in jobs:
+            lanes.setdefault((id(job.contract.w3), job.lane), []).append(job)
+        list(self._executor.map(self._run_lane, lanes.values()))
+        return jobs
+
+    def retry(self, job):
+        """
+            Builds a job that didn't go out again after a backoff, or gives up
+            on it once it has had MAX_ATTEMPTS
+        """
+        job.attempts += 1
+        if job.attempts >= MAX_ATTEMPTS:
+            log.error("Giving up on relay", extra={'function': job.function, 'call_args': job.args,
+                                                   'attempts': job.attempts, 'error': str(job.error)})
+            job.done.set()
+            if self.on_failed:
+                self.on_failed(job)
+            return
+        timer = threading.Timer(RETRY_DELAY * 2 ** (job.attempts - 1), self._resubmit, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def retry_dropped(self, tracked):
+        """
+            Retries the relay of a transaction the watchdog dropped (its nonce
+            went to another transaction, so it will never be mined)
+            Returns False if the transaction wasn't sent by this engine
+        """
+        job = tracked.job
+        if not isinstance(job, RelayJob):
+            return False
+        job.error = RuntimeError(f"Nonce {tracked.nonce} was used by another transaction")
+        self.retry(job)
+        return True
+
+    def _resubmit(self, job):
+        job.nonce = None
+        job.tx = None
+        try:
+            self._executor.submit(self._prepare, job)
+        except RuntimeError:
+            # The engine was closed in the meantime
+            job.done.set()
+
+    def _run_lane(self, jobs):
+        for job in jobs:
+            self._prepare(job)
+
+    def _prepare(self, job):
+        w3 = job.contract.w3
+        oracle = get_fee_oracle(w3)
+        call = getattr(job.contract.functions, job.function)(*job.args)
+        try:
+            submitter = self.submitter(w3)
+            gas = oracle.estimate_gas(call, self.signer.address, job.batch_size)
+            fees = oracle.fee_fields()
+        except Exception as e:
+            # Nothing reserved yet, so no nonce to give back
+            job.error = e
+            log.error("Failed to build relay", extra={'function': job.function, 'call_args': job.args, 'error': str(e)})
+            self.retry(job)
+            return
+
+        job.nonce = submitter.next_nonce()
+        try:
+            job.tx = call.build_transaction({
+                'from': self.signer.address,
+                'nonce': job.nonce,
+                'gas': gas,
+                'chainId': submitter.chain_id,
+                **fees,
+            })
+            signed_txn = self.signer.sign_transaction(job.tx)
+        except Exception as e:
+            job.error = e
+            log.error("Failed to sign relay", extra={'function': job.function, 'call_args': job.args, 'error': str(e)})
+            submitter.skip(job.nonce, job)
+            return
+        submitter.submit(job.nonce, signed_txn, job)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for submitter in self._submitters.values():
+            submitter.stop()
@@ -0,0 +1,129 @@
+#!/bin/python
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+
+# What can be recorded and replayed (see the run_* functions)
+TARGETS = ('scan', 'ordered', 'ape', 'bridge')
+
+
+def run_scan(args):
+    import listener
+    eventfile = os.path.join(tempfile.gettempdir(), 'replay_deposit_logs.csv')
+    listener.scan_blocks(args.chain, args.start, args.end, args.contract, eventfile=eventfile)
+
+
+def run_ordered(args):
+    from chain_config import get_web3
+    from reading_the_chain import is_ordered_block
+    w3 = get_web3('eth')
+    return [is_ordered_block(w3, block_num) for block_num in args.blocks]
+
+
+def run_ape(args):
+    from get_ape_info import get_ape_info
+    return [get_ape_info(ape_id) for ape_id in args.ids]
+
+
+def run_bridge(args):
+    """
+        The listen loop for `duration` seconds
+        Its background threads poll on timers, so a replay is only as
+        deterministic as the timing: requests beyond the recording get the
+        last recorded answer, and requests that were never made get an error
+    """
+    import bridge
+    from signer import get_signer
+    source_contract, destination_contract = bridge.get_contracts()
+    stop = threading.Event()
+    timer = threading.Timer(args.duration, stop.set)
+    timer.start()
+    try:
+        bridge.bridge_loop(source_contract, destination_contract, get_signer('sk.txt'), args.mode,
+                           poll_interval=args.poll_interval, stop=stop)
+    finally:
+        timer.cancel()
+
+
+RUNNERS = {'scan': run_scan, 'ordered': run_ordered, 'ape': run_ape, 'bridge': run_bridge}
+
+
+def record(args):
+    """
+        Runs the target once against the live endpoints, recording every RPC call
+    """
+    os.environ['RPC_RECORD'] = args.recording
+    from rpc_replay import get_recorder
+    start = time.perf_counter()
+    RUNNERS[args.target](args)
+    elapsed = time.perf_counter() - start
+    recorder = get_recorder(args.recording)
+    recorder.close()
+    return {'target': args.target, 'mode': 'record', 'seconds': elapsed, 'requests': recorder.count}
+
+
+def replay(args):
+    """
+        Runs the target `repeat` times against the recording, starting it over each time
+    """
+    os.environ['RPC_REPLAY'] = args.recording
+    os.environ['RPC_REPLAY_SCALE'] = str(args.scale)
+    from rpc_replay import replays
+    times = []
+    hits = misses = 0
+    for _ in range(args.repeat):
+        for provider in replays():
+            provider.rewind()
+        start = time.perf_counter()
+        RUNNERS[args.target](args)
+        times.append(time.perf_counter() - start)
+        hits = sum(provider.hits for provider in replays())
+        misses = sum(provider.misses for provider in replays())
+    return {
+        'target': args.target,
+        'mode': 'replay',
+        'scale': args.scale,
+        'seconds': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        # Of the last run: misses mean the code made requests the recording doesn't have
+        'hits': hits,
+        'misses': misses,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record RPC traffic of a code path once, then benchmark it offline from the recording")
+    parser.add_argument('action', choices=['record', 'replay'])
+    parser.add_argument('target', choices=TARGETS)
+    parser.add_argument('recording', help="gzip'd JSON lines file to write (record) or read (replay)")
+    parser.add_argument('--scale', type=float, default=0,
+                        help="replay each call with this fraction of its recorded latency (1 = original timing, 0 = none)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chain', default='avax', help="scan: chain to scan")
+    parser.add_argument('--start', type=int, default=0, help="scan: first block")
+    parser.add_argument('--end', default='latest', help="scan: last block")
+    parser.add_argument('--contract', help="scan: address of the contract emitting Deposit events")
+    parser.add_argument('--blocks', type=int, nargs='+', default=[], help="ordered: block numbers")
+    parser.add_argument('--ids', type=int, nargs='+', default=[0, 1, 2], help="ape: ape ids")
+    parser.add_argument('--mode', default='single', help="bridge: relay mode")
+    parser.add_argument('--duration', type=float, default=30, help="bridge: seconds to run the loop for")
+    parser.add_argument('--poll-interval', type=float, default=5)
+    parser.add_argument('--output', default='replay_bench.json', help="where to write the results as JSON")
+    args = parser.parse_args()
+    if args.end != 'latest':
+        args.end = int(args.end)
+
+    result = record(args) if args.action == 'record' else replay(args)
+    if args.action == 'record':
+        print(f"Recorded {result['requests']} requests of {args.target} in {result['seconds']:.3f}s to {args.recording}")
+    else:
+        print(f"Replayed {args.target} {args.repeat} times (scale {args.scale}): "
+              f"min {result['min']:.4f}s, median {result['median']:.4f}s, {result['misses']} misses")
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+from web3.providers.base import JSONBaseProvider
+from web3.providers.rpc import HTTPProvider
+
+from rate_limit import RateLimitError, is_rate_limited
+
+
+# Signed transactions are sent to every endpoint, the first to accept one wins
+BROADCAST_METHODS = {'eth_sendRawTransaction'}
+
+# Filters live on the node that created them, so follow-up calls must go back there
+FILTER_CREATE_METHODS = {'eth_newFilter', 'eth_newBlockFilter', 'eth_newPendingTransactionFilter'}
+FILTER_METHODS = {'eth_getFilterChanges', 'eth_getFilterLogs', 'eth_uninstallFilter'}
+
+# Requests that must not be sent twice (a hedge would create a second filter
+# or have the node sign and send a second transaction)
+NO_HEDGE_METHODS = FILTER_CREATE_METHODS | {'eth_sendTransaction'}
+
+# Filter ids remembered per provider
+MAX_FILTERS = 1024
+
+
+class EndpointHealth:
+    """
+        One endpoint's provider and its moving latency and error rate
+        latency/error_rate are exponentially weighted (alpha), p95 comes from
+        the last `window` successful request times
+    """
+
+    def __init__(self, provider, weight=1, alpha=0.2, window=200):
+        self.provider = provider
+        self.url = str(getattr(provider, 'endpoint_uri', provider))
+        self.weight = weight
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, ok, cooldown=5.0, max_failures=3):
+        with self._lock:
+            self.requests += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.failures = 0
+                self.samples.append(elapsed)
+                self.latency = elapsed if self.latency is None else self.latency + self.alpha * (elapsed - self.latency)
+                return
+            self.errors += 1
+            self.failures += 1
+            if self.failures >= max_failures:
+                # Back off for longer each time it keeps failing, up to a minute
+                self.down_until = time.monotonic() + min(60.0, cooldown * 2 ** (self.failures - max_failures))
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.down_until
+
+    def p95(self, min_samples=20):
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def score(self):
+        # Lower is better: untried endpoints count as fast so they get measured
+        latency = self.latency if self.latency is not None else 0.0
+        return latency * (1 + 10 * self.error_rate) / self.weight
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency': self.latency,
+            'p95': self.p95(),
+            'error_rate': self.error_rate,
+            'healthy': self.healthy(),
+        }
+
+
+class FailoverProvider(JSONBaseProvider):
+    """
+        Web3 provider over several RPC endpoints for the same chain
+
+        Reads go to the endpoint with the best latency/error score, and fail over
+        to the next one if it errors or times out. With hedge=True, a read that
+        takes longer than its endpoint's p95 is also sent to the next best
+        endpoint and the first answer is used. eth_sendRawTransaction is
+        broadcast to every endpoint. Endpoints that fail `max_failures` times
+        in a row are skipped for a cooldown (unless nothing else is left).
+
+        endpoints - URLs, (url, weight) pairs, objects with url/weight
+                    (like chain_config.Endpoint) or providers
+    """
+
+    def __init__(self, endpoints, hedge=True, timeout=10, cooldown=5.0, max_failures=3, **kwargs):
+        super().__init__(**kwargs)
+        self.endpoints = [self._endpoint(e, timeout) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError("FailoverProvider needs at least one endpoint")
+        self.hedge = hedge
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.hedged = 0
+        self._filters = OrderedDict()
+        self._filters_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2, thread_name_prefix='rpc-failover')
+
+    @staticmethod
+    def _endpoint(endpoint, timeout):
+        weight = 1
+        if isinstance(endpoint, tuple):
+            endpoint, weight = endpoint
+        elif hasattr(endpoint, 'url'):
+            endpoint, weight = endpoint.url, endpoint.weight
+        if isinstance(endpoint, str):
+            # Retries are handled here, by moving on to the next endpoint
+            endpoint = HTTPProvider(endpoint, request_kwargs={'timeout': timeout}, exception_retry_configuration=None)
+        return EndpointHealth(endpoint, weight)
+
+    def __str__(self):
+        return f"Failover connection {[e.url for e in self.endpoints]}"
+
+    @property
+    def endpoint_uri(self):
+        return self.ranked()[0].url
+
+    def ranked(self):
+        """
+            Endpoints from best to worst, the ones cooling down last
+        """
+        now = time.monotonic()
+        return sorted(self.endpoints, key=lambda e: (not e.healthy(now), e.score()))
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    def _call(self, endpoint, method, params):
+        start = time.perf_counter()
+        try:
+            response = endpoint.provider.make_request(method, params)
+            if is_rate_limited(response):
+                # Let another endpoint take the request
+                raise RateLimitError(response)
+        except Exception:
+            endpoint.record(time.perf_counter() - start, False, self.cooldown, self.max_failures)
+            raise
+        # A JSON-RPC error (e.g. a revert) is still a working endpoint
+        endpoint.record(time.perf_counter() - start, True, self.cooldown, self.max_failures)
+        return response
+
+    def make_request(self, method, params):
+        if method in BROADCAST_METHODS:
+            return self._broadcast(method, params)
+        if method in FILTER_METHODS and params:
+            endpoint = self._filters.get(params[0])
+            if endpoint is not None:
+                if method == 'eth_uninstallFilter':
+                    with self._filters_lock:
+                        self._filters.pop(params[0], None)
+                return self._call(endpoint, method, params)
+
+        ranked = self.ranked()
+        last_error = None
+        i = 0
+        while i < len(ranked):
+            endpoint = ranked[i]
+            backup = ranked[i + 1] if i + 1 < len(ranked) else None
+            deadline = endpoint.p95() if self.hedge and backup is not None and method not in NO_HEDGE_METHODS else None
+            try:
+                if deadline is not None:
+                    response, endpoint = self._hedged(endpoint, backup, deadline, method, params)
+                else:
+                    response = self._call(endpoint, method, params)
+            except Exception as e:
+                last_error = e
+                # A failed hedge already tried the backup as well
+                i += 1 if deadline is None else 2
+                continue
+            if method in FILTER_CREATE_METHODS and 'result' in response:
+                self._remember_filter(response['result'], endpoint)
+            return response
+        raise last_error
+
+    def _remember_filter(self, filter_id, endpoint):
+        with self._filters_lock:
+            self._filters[filter_id] = endpoint
+            # Filters that are never uninstalled expire on the node anyway
+            while len(self._filters) > MAX_FILTERS:
+                self._filters.popitem(last=False)
+
+    def _hedged(self, primary, backup, deadline, method, params):
+        first = self._executor.submit(self._call, primary, method, params)
+        try:
+            return first.result(timeout=deadline), primary
+        except TimeoutError:
+            pass
+        except Exception:
+            # Failed fast, so the backup is simply the next endpoint to try
+            return self._call(backup, method, params), backup
+        # Too slow for this endpoint, race the next best one against it
+        self.hedged += 1
+        second = self._executor.submit(self._call, backup, method, params)
+        owners = {first: primary, second: backup}
+        pending = set(owners)
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result(), owners[future]
+                except Exception as e:
+                    last_error = e
+        raise last_error
+
+    def _broadcast(self, method, params):
+        futures = [self._executor.submit(self._call, endpoint, method, params) for endpoint in self.endpoints]
+        error_response = None
+        last_error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if 'error' not in response:
+                    return response
+                # e.g. "already known" because another endpoint's node gossiped it first
+                error_response = error_response or response
+        if error_response is not None:
+            return error_response
+        raise last_error
+
+    def make_batch_request(self, requests):
+        last_error = None
+        for endpoint in self.ranked():
+            start = time.perf_counter()
+            try:
+                response = endpoint.provider.make_batch_request(requests)
+            except Exception as e:
+                endpoint.record(time.perf_counter() - start, False, self.cooldown, self.max_failures)
+                last_error = e
+                continue
+            endpoint.record(time.perf_counter() - start, True, self.cooldown, self.max_failures)
+            return response
+        raise last_error
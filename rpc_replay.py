@@ -0,0 +1,229 @@
+import atexit
+import functools
+import gzip
+import json
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict, deque
+
+import requests
+from web3._utils.encoding import Web3JsonEncoder
+from web3.middleware import Web3Middleware
+from web3.providers.base import JSONBaseProvider
+
+
+# Label for Web3 instances that aren't tied to a chain_config chain
+DEFAULT_CHAIN = 'default'
+
+# Label for off-chain JSON documents fetched with fetch_json
+HTTP_CHAIN = 'http'
+
+
+def _dumps(value, **kwargs):
+    return json.dumps(value, cls=Web3JsonEncoder, separators=(',', ':'), **kwargs)
+
+
+def request_key(chain, method, params):
+    """
+        What a recorded response is looked up by (params in canonical JSON)
+    """
+    return (chain, method, _dumps(params, sort_keys=True))
+
+
+class RPCRecorder:
+    """
+        Writes every JSON-RPC request/response pair of the Web3 instances it is
+        attached to into one gzip'd JSON lines file, one pair per line:
+            [chain, method, params, response, seconds]
+        Request ids are dropped and seconds is how long the node took to answer
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, chain, method, params, response, elapsed):
+        if isinstance(response, dict):
+            response = {key: value for key, value in response.items() if key not in ('id', 'jsonrpc')}
+        line = _dumps([chain, method, params, response, round(elapsed, 6)])
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + '\n')
+                self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def attach(self, w3, chain=DEFAULT_CHAIN):
+        """
+            Records w3's requests from now on, labelled with `chain`
+            The middleware goes to the innermost layer, so the raw responses are
+            recorded and replaying them runs through the same formatters
+        """
+        recorder = self
+
+        class RequestRecorder(Web3Middleware):
+            def wrap_make_request(self, make_request):
+                def middleware(method, params):
+                    start = time.perf_counter()
+                    response = make_request(method, params)
+                    recorder.record(chain, method, params, response, time.perf_counter() - start)
+                    return response
+                return middleware
+
+            def wrap_make_batch_request(self, make_batch_request):
+                def middleware(requests_info):
+                    start = time.perf_counter()
+                    response = make_batch_request(requests_info)
+                    # Each call is recorded on its own, with the time of the whole batch
+                    elapsed = time.perf_counter() - start
+                    if isinstance(response, list):
+                        for (method, params), item in zip(requests_info, response):
+                            recorder.record(chain, method, params, item, elapsed)
+                    return response
+                return middleware
+
+        w3.middleware_onion.inject(RequestRecorder, 'rpc_recorder', layer=0)
+        return w3
+
+
+@functools.lru_cache(maxsize=None)
+def get_recorder(path):
+    """
+        The one RPCRecorder writing to `path` (closed when the process exits)
+    """
+    recorder = RPCRecorder(path)
+    atexit.register(recorder.close)
+    return recorder
+
+
+def load_recording(path):
+    """
+        Reads a recording into {request_key: [(response, seconds), ...]}, in recorded order
+    """
+    responses = defaultdict(list)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            chain, method, params, response, elapsed = json.loads(line)
+            responses[request_key(chain, method, params)].append((response, elapsed))
+    return responses
+
+
+class ReplayMiss(Exception):
+    """
+        A request that isn't in the recording
+    """
+
+
+class ReplayProvider(JSONBaseProvider):
+    """
+        Answers requests from a recording instead of a node
+
+        A request that was recorded several times gets the recorded responses in
+        order, then keeps getting the last one (e.g. eth_blockNumber once the
+        recording runs out). Each answer waits for its recorded time multiplied
+        by `time_scale`: 1 replays the original timing, 0.1 runs ten times
+        faster and 0 doesn't wait at all.
+        Requests that were never recorded get a JSON-RPC error, or raise
+        ReplayMiss with strict=True.
+    """
+
+    def __init__(self, path, chain=DEFAULT_CHAIN, time_scale=0.0, strict=False, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.chain = chain
+        self.time_scale = time_scale
+        self.strict = strict
+        self.hits = 0
+        self.misses = 0
+        self._recording = load_recording(path)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.rewind()
+        _replays.add(self)
+
+    @property
+    def endpoint_uri(self):
+        return f"replay://{self.path}#{self.chain}"
+
+    def __str__(self):
+        return f"Replay of {self.path} ({self.chain})"
+
+    def is_connected(self, show_traceback=False):
+        return True
+
+    def rewind(self):
+        """
+            Starts the recording over, so a benchmark can be run again
+        """
+        with self._lock:
+            self._queues = {key: deque(entries) for key, entries in self._recording.items()}
+            self.hits = self.misses = 0
+
+    def _answer(self, method, params):
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            entries = self._queues.get(request_key(self.chain, method, params))
+            if not entries:
+                self.misses += 1
+                if self.strict:
+                    raise ReplayMiss(f"No recorded response for {method} {params}")
+                return {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': -32000, 'message': f"No recorded response for {method}"}}, 0.0
+            response, elapsed = entries.popleft() if len(entries) > 1 else entries[0]
+            self.hits += 1
+        return {'jsonrpc': '2.0', 'id': request_id, **response}, elapsed
+
+    def make_request(self, method, params):
+        response, elapsed = self._answer(method, params)
+        if self.time_scale:
+            time.sleep(elapsed * self.time_scale)
+        return response
+
+    def make_batch_request(self, batch_requests):
+        answers = [self._answer(method, params) for method, params in batch_requests]
+        if self.time_scale and answers:
+            # The calls of a batch were recorded with the time of the whole batch
+            time.sleep(max(elapsed for _, elapsed in answers) * self.time_scale)
+        return [response for response, _ in answers]
+
+
+# Every live ReplayProvider, see replays()
+_replays = weakref.WeakSet()
+
+
+def replays():
+    """
+        The ReplayProviders in use (one per chain, plus one for fetch_json)
+    """
+    return list(_replays)
+
+
+@functools.lru_cache(maxsize=None)
+def _http_replay(path, time_scale):
+    return ReplayProvider(path, HTTP_CHAIN, time_scale)
+
+
+def fetch_json(url, timeout=None):
+    """
+        GETs a JSON document that goes with the RPC traffic (e.g. NFT metadata
+        behind a tokenURI), so it is recorded and replayed along with it when
+        RPC_RECORD / RPC_REPLAY are set (see chain_config.connect)
+        Returns the parsed JSON, or None if the server didn't answer 200
+    """
+    replay = os.environ.get('RPC_REPLAY')
+    if replay:
+        return _http_replay(replay, float(os.environ.get('RPC_REPLAY_SCALE', 0))).make_request('GET', [url]).get('result')
+    start = time.perf_counter()
+    response = requests.get(url, timeout=timeout)
+    result = response.json() if response.status_code == 200 else None
+    record = os.environ.get('RPC_RECORD')
+    if record:
+        get_recorder(record).record(HTTP_CHAIN, 'GET', [url], {'result': result}, time.perf_counter() - start)
+    return result
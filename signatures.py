@@ -1,6 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
 from web3 import Web3
 import eth_account
-from eth_account.messages import encode_defunct
+from eth_account.messages import SignableMessage, encode_defunct
 
 
 def sign(m):
@@ -41,6 +45,77 @@ def verify(m, public_key, signed_message):
     return valid_signature
 
 
+def _to_signable(m):
+    # Text is encoded the same way as verify(), raw bytes as in verify.py/gen_keys.py
+    if isinstance(m, SignableMessage):
+        return m
+    if isinstance(m, str):
+        return encode_defunct(text=m)
+    return encode_defunct(m)
+
+
+def _to_signature(sig):
+    # Accept SignedMessage objects as well as raw/hex signatures
+    return getattr(sig, 'signature', sig)
+
+
+def _verify_chunk(chunk):
+    """
+        Recovers the signer of every (message, signature, address) in chunk
+        Runs in a worker process, so it only gets picklable values
+    """
+    results = []
+    for message, signature, expected_address in chunk:
+        try:
+            signer = eth_account.Account.recover_message(message, signature=signature)
+            valid = signer.lower() == expected_address.lower()
+        except Exception:
+            # Malformed signatures (or addresses) simply don't verify
+            valid = False
+        results.append(valid)
+    return results
+
+
+def verify_many(messages, signatures, expected_addresses, workers=None, chunk_size=256):
+    """
+        Bulk version of verify()
+        messages - text strings, bytes or already encoded SignableMessages
+        signatures - SignedMessage objects or raw/hex signatures
+        expected_addresses - the address each message should recover to
+
+        Signer recovery is spread over a process pool in chunks of chunk_size
+        Returns (valid, stats) where valid is a list of booleans in input order
+        and stats has the count, elapsed seconds and verifications per second
+    """
+    if not len(messages) == len(signatures) == len(expected_addresses):
+        raise ValueError("verify_many expects lists of the same length")
+    start = time.perf_counter()
+
+    items = [(_to_signable(m), _to_signature(sig), addr)
+             for m, sig, addr in zip(messages, signatures, expected_addresses)]
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+
+    valid = []
+    if workers <= 1:
+        # Not worth starting processes for a single chunk
+        for chunk in chunks:
+            valid.extend(_verify_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk_results in pool.map(_verify_chunk, chunks):
+                valid.extend(chunk_results)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'count': len(valid),
+        'workers': max(workers, 1),
+        'seconds': elapsed,
+        'per_second': len(valid) / elapsed if elapsed > 0 else 0.0,
+    }
+    return valid, stats
+
+
 if __name__ == "__main__":
     import random
     import string
@@ -0,0 +1,86 @@
+import functools
+import json
+import os
+from pathlib import Path
+
+import eth_account
+
+
+class Signer:
+    """
+        Holds an account that has already been loaded and derived, so signing
+        a transaction or message doesn't touch the key file again
+        Anything with .address, .sign_transaction(tx) and .sign_message(msg)
+        can be used in its place (e.g. an eth_account LocalAccount)
+    """
+
+    def __init__(self, account):
+        self._account = account
+        self.address = account.address
+
+    def sign_transaction(self, tx):
+        return self._account.sign_transaction(tx)
+
+    def sign_message(self, message):
+        return self._account.sign_message(message)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.address})"
+
+
+class KeyFileSigner(Signer):
+    """
+        Signer for a plain text key file like "sk.txt" or "secret_key.txt"
+        The key is the first line of the file, with or without a 0x prefix
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'r') as f:
+            sk = f.readline().strip()
+        if not sk:
+            raise ValueError(f"Your account {Path(filename).name} is empty")
+        super().__init__(eth_account.Account.from_key(sk))
+
+
+class KeystoreSigner(Signer):
+    """
+        Signer for an encrypted JSON keystore (as written by geth or eth_account.Account.encrypt)
+        The password comes from the KEYSTORE_PASSWORD environment variable unless given
+    """
+
+    def __init__(self, filename, password=None):
+        if password is None:
+            password = os.environ.get('KEYSTORE_PASSWORD', '')
+        with open(filename, 'r') as f:
+            keystore = json.load(f)
+        super().__init__(eth_account.Account.from_key(eth_account.Account.decrypt(keystore, password)))
+
+
+class TestSigner(Signer):
+    """
+        In-process signer with a fresh (or given) key, for tests and local dev chains
+    """
+
+    def __init__(self, private_key=None):
+        if private_key is None:
+            account = eth_account.Account.create()
+        else:
+            account = eth_account.Account.from_key(private_key)
+        super().__init__(account)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_signer(path):
+    with open(path, 'r') as f:
+        is_keystore = f.read(1) == '{'
+    if is_keystore:
+        return KeystoreSigner(path)
+    return KeyFileSigner(path)
+
+
+def get_signer(filename='sk.txt'):
+    """
+        Returns the signer for filename, loading it only the first time
+        Files that contain JSON are treated as keystores, anything else as a plain key file
+    """
+    return _load_signer(os.path.abspath(filename))
@@ -0,0 +1,138 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+
+# Attributes every LogRecord has, anything else on a record came from `extra`
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# Level for third-party loggers (web3, websockets...), which are chatty at INFO
+LIBRARY_LEVEL = 'WARNING'
+
+_listener = None
+_setup_lock = threading.Lock()
+_level = 'INFO'
+_levels = {}
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+        One JSON object per line: ts, level, logger, msg, then every `extra` field
+        as its own key (bytes such as transaction hashes become 0x hex strings)
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=_json_default)
+
+
+class TextFormatter(logging.Formatter):
+    """
+        Human readable lines, with the `extra` fields appended as key=value
+    """
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f"{key}={_json_default(value) if isinstance(value, (bytes, bytearray)) else value}"
+                          for key, value in vars(record).items() if key not in RESERVED_ATTRS)
+        return f"{line} {fields}" if fields else line
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+        Hands records to the writer thread as they are
+        The stock QueueHandler formats every message in the caller's thread so
+        records can be pickled, the queue here never leaves the process
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def parse_levels(spec):
+    """
+        "bridge=DEBUG,rate_limit=WARNING" -> {'bridge': 'DEBUG', 'rate_limit': 'WARNING'}
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level=None, levels=None, filename=None, json_format=None):
+    """
+        Routes every log record through a queue to a background writer thread,
+        so logging calls never wait on the terminal or a file
+
+        level - level of the loggers from get_logger (default $LOG_LEVEL or INFO),
+                other libraries log at LIBRARY_LEVEL
+        levels - per-module levels, e.g. {'bridge': 'DEBUG', 'web3': 'INFO'} (default
+                 from $LOG_LEVELS, "bridge=DEBUG,web3=INFO")
+        filename - write to this file instead of stdout (default $LOG_FILE)
+        json_format - JSON lines, or plain text (default unless $LOG_FORMAT=text)
+    Only the first call configures anything, later ones return the same listener
+    """
+    global _listener, _level, _levels
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        _level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+        _levels = levels if levels is not None else parse_levels(os.environ.get('LOG_LEVELS', ''))
+        filename = filename or os.environ.get('LOG_FILE')
+        if json_format is None:
+            json_format = os.environ.get('LOG_FORMAT', 'json').lower() != 'text'
+
+        handler = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if json_format else TextFormatter())
+
+        # Unbounded, so a burst of records never blocks the relay loop
+        records = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.addHandler(LocalQueueHandler(records))
+        root.setLevel(LIBRARY_LEVEL)
+        for name, module_level in _levels.items():
+            logging.getLogger(name).setLevel(module_level)
+
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # Write out whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def get_logger(name):
+    """
+        logging.getLogger(name), with logging set up on first use if nothing else
+        configured it (so library callers still see the output, as with print)
+    """
+    if not logging.getLogger().handlers:
+        setup_logging()
+    logger = logging.getLogger(name)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(_levels.get(name, _level))
+    return logger
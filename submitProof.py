@@ -1,10 +1,11 @@
 import eth_account
 import random
 import string
-import json
 from pathlib import Path
 from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware  # Necessary for POA chains
+
+from chain_config import get_web3, load_json
+from signer import get_signer
 
 
 def merkle_assignment():
@@ -153,7 +154,6 @@ def sign_challenge(challenge):
     acct = get_account()
 
     addr = acct.address
-    eth_sk = acct.key
 
     # Sign the challenge message
     eth_encoded_msg = eth_account.messages.encode_defunct(text=challenge)
@@ -186,7 +186,7 @@ def send_signed_msg(proof, random_leaf):
     })
     
     # Sign the transaction
-    signed_tx = w3.eth.account.sign_transaction(tx, acct.key)
+    signed_tx = acct.sign_transaction(tx)
     
     # Send the transaction
     tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
@@ -203,28 +203,19 @@ def connect_to(chain):
     if chain not in ['avax','bsc']:
         print(f"{chain} is not a valid option for 'connect_to()'")
         return None
-    if chain == 'avax':
-        api_url = f"https://api.avax-test.network/ext/bc/C/rpc"  # AVAX C-chain testnet
-    else:
-        api_url = f"https://data-seed-prebsc-1-s1.binance.org:8545/"  # BSC testnet
-    w3 = Web3(Web3.HTTPProvider(api_url))
-    # inject the poa compatibility middleware to the innermost layer
-    w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+    # Endpoints come from chain_config, the connection is shared by later calls
+    w3 = get_web3(chain)
 
     return w3
 
 
 def get_account():
     """
-        Returns an account object recovered from the secret key
-        in "sk.txt"
+        Returns a signer for the secret key in "sk.txt"
+        The key is only read and derived the first time, later calls reuse it
     """
     cur_dir = Path(__file__).parent.absolute()
-    with open(cur_dir.joinpath('sk.txt'), 'r') as f:
-        sk = f.readline().rstrip()
-    if sk[0:2] == "0x":
-        sk = sk[2:]
-    return eth_account.Account.from_key(sk)
+    return get_signer(cur_dir.joinpath('sk.txt'))
 
 
 def get_contract_info(chain):
@@ -235,9 +226,8 @@ def get_contract_info(chain):
     contract_file = Path(__file__).parent.absolute() / "contract_info.json"
     if not contract_file.is_file():
         contract_file = Path(__file__).parent.parent.parent / "tests" / "contract_info.json"
-    with open(contract_file, "r") as f:
-        d = json.load(f)
-        d = d[chain]
+    # Parsed once, later calls get the cached copy
+    d = load_json(contract_file)[chain]
     return d['address'], d['abi']
 
 
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+from web3 import AsyncWeb3, WebSocketProvider
+
+from structured_logging import get_logger
+
+
+log = get_logger('subscriptions')
+
+
+class SubscriptionThread(threading.Thread):
+    """
+        Runs an eth_subscribe feed over WebSocket, with a polling fallback
+
+        Subclasses set subscription_type ('logs', 'newHeads'...), handle each
+        pushed item in on_message() and catch up over HTTP in poll(). poll() runs
+        right after every (re)subscription, to cover whatever was missed while
+        disconnected, and every `poll_interval` seconds whenever there is no
+        WebSocket (or it can't connect, in which case it is retried with
+        exponential backoff).
+    """
+
+    subscription_type = None
+
+    def __init__(self, ws_url=None, poll_interval=5, reconnect_delay=1, max_reconnect_delay=30):
+        super().__init__(daemon=True)
+        self.ws_url = ws_url
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.mode = 'starting'
+        self.reconnects = 0
+        self._stopped = threading.Event()
+        self._loop = None
+        self._task = None
+
+    def subscription_arg(self):
+        return None
+
+    def poll(self):
+        raise NotImplementedError
+
+    def on_message(self, result):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stopped.set()
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            if self.ws_url:
+                self._task = asyncio.ensure_future(self._subscribe())
+                try:
+                    await self._task
+                    delay = self.reconnect_delay
+                except asyncio.CancelledError:
+                    if self._stopped.is_set():
+                        return
+                except Exception as e:
+                    log.warning("Subscription dropped", extra={'subscription': self.subscription_type, 'ws_url': self.ws_url,
+                                                               'error': str(e)})
+                self.reconnects += 1
+            # Poll until it's time to try the WebSocket again (or for good without one)
+            self.mode = 'polling'
+            deadline = time.monotonic() + (delay if self.ws_url else float('inf'))
+            delay = min(delay * 2, self.max_reconnect_delay)
+            # (nothing else runs on this event loop meanwhile, so it can block)
+            while not self._stopped.is_set() and time.monotonic() < deadline:
+                try:
+                    self.poll()
+                except Exception as e:
+                    log.error("Polling failed", extra={'subscription': self.subscription_type, 'error': str(e)})
+                self._stopped.wait(min(self.poll_interval, max(0, deadline - time.monotonic())))
+
+    async def _subscribe(self):
+        async with AsyncWeb3(WebSocketProvider(self.ws_url)) as w3:
+            # Subscribe first, then catch up, so nothing falls between the two
+            await w3.eth.subscribe(self.subscription_type, self.subscription_arg())
+            await asyncio.to_thread(self.poll)
+            self.mode = 'subscribed'
+            async for message in w3.socket.process_subscriptions():
+                self.on_message(message['result'])
@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+import bridge_daemon
+from bridge_daemon import Supervisor
+from tx_watchdog import event_id
+
+
+class FakeWorker:
+    """
+        Stands in for the submitter's Worker, recording what it is sent
+    """
+
+    def __init__(self, name='submitter'):
+        self.name = name
+        self.process = SimpleNamespace(pid=1)
+        self.restarts = 0
+        self.sent = []
+
+    def start(self, context, target, args):
+        pass
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def deposit(block, log_index=0):
+    return AttributeDict({'event': 'Deposit', 'blockNumber': block, 'logIndex': log_index,
+                          'transactionHash': HexBytes(bytes([block]) * 32)})
+
+
+def make_supervisor(tmp_path):
+    supervisor = Supervisor(checkpoint_file=str(tmp_path / 'checkpoint.json'), confirmations=(0, 0))
+    supervisor.workers['submitter'] = FakeWorker()
+    supervisor.scanned['source'] = supervisor.checkpoint['source'] = 9
+    return supervisor
+
+
+def test_failed_events_are_kept_and_retried(tmp_path):
+    supervisor = make_supervisor(tmp_path)
+    submitter = supervisor.workers['submitter']
+    sent, failed = deposit(10), deposit(11)
+    supervisor.handle(None, ('events', 'source', 12, [sent, failed]))
+    assert submitter.sent == [('relay', 1, [sent, failed])]
+
+    supervisor.handle(None, ('sent', [event_id(sent)]))
+    supervisor.handle(None, ('done', [1]))
+    # The unsent event holds the checkpoint back
+    assert list(supervisor.unacked[1][2].values()) == [failed]
+    assert supervisor.checkpoint['source'] == 9
+
+    attempts, retry_at = supervisor.retries[1]
+    assert attempts == 1
+    supervisor.retry_due(retry_at - 0.1)
+    assert len(submitter.sent) == 1
+    supervisor.retry_due(retry_at)
+    assert submitter.sent[-1] == ('relay', 1, [failed])
+
+    # Failing again backs off for longer
+    supervisor.handle(None, ('done', [1]))
+    attempts, next_retry_at = supervisor.retries[1]
+    assert attempts == 2
+    assert next_retry_at - retry_at >= bridge_daemon.RELAY_RETRY_DELAY
+
+    supervisor.retry_due(next_retry_at)
+    supervisor.handle(None, ('sent', [event_id(failed)]))
+    supervisor.handle(None, ('done', [1]))
+    assert not supervisor.unacked and not supervisor.retries
+    assert supervisor.checkpoint['source'] == 12
+
+
+def test_restarted_submitter_gets_retries_at_once(tmp_path):
+    supervisor = make_supervisor(tmp_path)
+    failed = deposit(10)
+    supervisor.handle(None, ('events', 'source', 10, [failed]))
+    supervisor.handle(None, ('done', [1]))
+
+    restarted = FakeWorker()
+    supervisor.workers['submitter'] = restarted
+    supervisor.start_worker(restarted)
+    assert restarted.sent == [('relay', 1, [failed])]
+    # Not sent a second time when its backoff runs out
+    assert supervisor.retries[1][1] is None
+    supervisor.retry_due(float('inf'))
+    assert len(restarted.sent) == 1
+
+
+def test_relayed_events_above_the_checkpoint_survive_a_restart(tmp_path):
+    supervisor = make_supervisor(tmp_path)
+    relayed = deposit(12)
+    # Confirmed before the scanner could vouch for its whole block
+    supervisor.handle(None, ('events', 'source', 11, [relayed]))
+    supervisor.handle(None, ('sent', [event_id(relayed)]))
+    supervisor.handle(None, ('done', [1]))
+    assert supervisor.checkpoint['source'] == 11
+
+    restarted = Supervisor(checkpoint_file=str(tmp_path / 'checkpoint.json'), confirmations=(0, 0))
+    restarted.workers['submitter'] = FakeWorker()
+    assert restarted.checkpoint == {'source': 11}
+    # Re-scanned from block 12 after the restart, but not relayed again
+    restarted.handle(None, ('events', 'source', 12, [relayed, deposit(12, 1)]))
+    assert restarted.workers['submitter'].sent == [('relay', 1, [deposit(12, 1)])]
+
+
+def test_dropped_relays_are_queued_again(tmp_path):
+    supervisor = make_supervisor(tmp_path)
+    submitter = supervisor.workers['submitter']
+    dropped, other = deposit(10), deposit(11)
+    supervisor.handle(None, ('events', 'source', 11, [dropped, other]))
+    supervisor.handle(None, ('sent', [event_id(dropped), event_id(other)]))
+    supervisor.handle(None, ('done', [1]))
+    assert supervisor.checkpoint['source'] == 11
+
+    supervisor.handle(None, ('dropped', [dropped]))
+    assert submitter.sent[-1] == ('relay', 2, [dropped])
+    # Back to just below it, with the other event remembered as relayed
+    assert supervisor.checkpoint['source'] == 9
+    assert list(supervisor.relayed) == [event_id(other)]
+
+    supervisor.handle(None, ('sent', [event_id(dropped)]))
+    supervisor.handle(None, ('done', [2]))
+    assert supervisor.checkpoint['source'] == 11
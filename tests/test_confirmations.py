@@ -0,0 +1,91 @@
+import hashlib
+
+from web3.datastructures import AttributeDict
+
+from confirmations import ConfirmationTracker
+
+
+def block_hash(number, fork):
+    return hashlib.sha256(f"{fork}:{number}".encode()).digest()
+
+
+class FakeChain:
+    """
+        Canonical headers by number, plus every header ever produced by hash
+    """
+
+    def __init__(self, head):
+        self.blocks = {}
+        self.by_hash = {}
+        self.extend(0, head, fork='a')
+
+    def extend(self, first, last, fork):
+        for number in range(first, last + 1):
+            parent = self.blocks[number - 1].hash if number else b'\0' * 32
+            header = AttributeDict({'number': number, 'hash': block_hash(number, fork), 'parentHash': parent})
+            self.blocks[number] = header
+            self.by_hash[header.hash] = header
+        for number in [n for n in self.blocks if n > last]:
+            del self.blocks[number]
+
+    @property
+    def head(self):
+        return max(self.blocks)
+
+    def get_block(self, block_id):
+        if block_id == 'latest':
+            return self.blocks[self.head]
+        if isinstance(block_id, int):
+            return self.blocks[block_id]
+        return self.by_hash[bytes(block_id)]
+
+
+class FakeWeb3:
+    def __init__(self, chain):
+        self.eth = chain
+
+
+def event_in(chain, number, log_index=0):
+    return AttributeDict({'blockNumber': number, 'blockHash': chain.blocks[number].hash,
+                          'transactionHash': bytes([log_index]) * 32, 'logIndex': log_index})
+
+
+def test_releases_events_once_deep_enough():
+    chain = FakeChain(100)
+    tracker = ConfirmationTracker(FakeWeb3(chain), depth=2)
+    tracker.poll_head()
+    tracker.add([event_in(chain, 100)])
+    assert tracker.pop_confirmed() == []
+
+    chain.extend(101, 103, fork='a')
+    assert tracker.poll_head() == (103, None)
+    assert [event.blockNumber for event in tracker.pop_confirmed()] == [100]
+
+
+def test_reorg_under_a_multi_block_jump_is_noticed():
+    chain = FakeChain(100)
+    tracker = ConfirmationTracker(FakeWeb3(chain), depth=2)
+    tracker.poll_head()
+    tracker.add([event_in(chain, 100)])
+
+    # Block 100 is replaced and the new chain is already 3 blocks past it
+    # by the next poll, so the new head's parent (102) was never seen before
+    chain.extend(100, 103, fork='b')
+    head, fork_block = tracker.poll_head()
+    assert (head, fork_block) == (103, 99)
+    assert tracker.pop_confirmed() == []
+    assert tracker.pending() == []
+
+
+def test_orphaned_event_found_by_pop_confirmed_asks_for_rescan():
+    chain = FakeChain(100)
+    tracker = ConfirmationTracker(FakeWeb3(chain), depth=0, ring_size=4)
+    tracker.poll_head()
+    chain.extend(101, 110, fork='a')
+    tracker.poll_head()
+    # An event from a block that has since fallen out of the ring and was reorged
+    stale = AttributeDict({'blockNumber': 95, 'blockHash': block_hash(95, 'x'),
+                           'transactionHash': b'\1' * 32, 'logIndex': 0})
+    tracker.add([stale])
+    assert tracker.pop_confirmed() == []
+    assert tracker.poll_head() == (110, 94)
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import pytest
+import websockets
+from web3 import EthereumTesterProvider, Web3
+
+from log_stream import LogStream
+
+
+DEPOSIT_ABI = [{'type': 'event', 'name': 'Deposit', 'anonymous': False, 'inputs': [
+    {'name': 'token', 'type': 'address', 'indexed': True},
+    {'name': 'recipient', 'type': 'address', 'indexed': True},
+    {'name': 'amount', 'type': 'uint256', 'indexed': False},
+]}]
+
+TOKEN = '0x' + 'ab' * 20
+RECIPIENT = '0x' + 'cd' * 20
+
+
+def deploy_emitter(w3, amount=5):
+    """
+        A contract whose every call emits Deposit(TOKEN, RECIPIENT, amount)
+    """
+    topic = Web3.keccak(text='Deposit(address,address,uint256)')
+    runtime = bytes([0x60, amount, 0x60, 0, 0x52, 0x73]) + bytes.fromhex(RECIPIENT[2:]) + b'\x73' \
+        + bytes.fromhex(TOKEN[2:]) + b'\x7f' + topic + bytes([0x60, 0x20, 0x60, 0, 0xa3, 0x00])
+    init = bytes([0x60, len(runtime), 0x60, 12, 0x60, 0, 0x39, 0x60, len(runtime), 0x60, 0, 0xf3]) + runtime
+    tx_hash = w3.eth.send_transaction({'from': w3.eth.accounts[0], 'data': init})
+    return w3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+
+
+def emit(w3, address):
+    tx_hash = w3.eth.send_transaction({'from': w3.eth.accounts[0], 'to': address, 'gas': 100000})
+    return w3.eth.wait_for_transaction_receipt(tx_hash).logs[0]
+
+
+def raw_log(log):
+    """
+        A log as a node pushes it over eth_subscription
+    """
+    return {
+        'address': log['address'],
+        'topics': ['0x' + bytes(topic).hex() for topic in log['topics']],
+        'data': '0x' + bytes(log['data']).hex(),
+        'blockNumber': hex(log['blockNumber']),
+        'blockHash': '0x' + bytes(log['blockHash']).hex(),
+        'transactionHash': '0x' + bytes(log['transactionHash']).hex(),
+        'transactionIndex': hex(log['transactionIndex']),
+        'logIndex': hex(log['logIndex']),
+        'removed': False,
+    }
+
+
+class WebSocketNode:
+    """
+        Stand-in for a node's WebSocket endpoint: accepts eth_subscribe, pushes
+        whatever the test hands to push(), and can drop every connection
+    """
+
+    def __init__(self):
+        self.connections = []
+        self.subscribed = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+
+        async def handler(connection):
+            self.connections.append(connection)
+            try:
+                async for message in connection:
+                    request = json.loads(message)
+                    result = '0xabc' if request['method'] == 'eth_subscribe' else None
+                    await connection.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': result}))
+                    if request['method'] == 'eth_subscribe':
+                        self.subscribed.set()
+            finally:
+                self.connections.remove(connection)
+
+        async def main():
+            self.server = await websockets.serve(handler, '127.0.0.1', 0)
+            self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+            ready.set()
+            await asyncio.Future()
+
+        self.loop.run_until_complete(main())
+
+    def push(self, log):
+        message = json.dumps({'jsonrpc': '2.0', 'method': 'eth_subscription',
+                              'params': {'subscription': '0xabc', 'result': log}})
+        for connection in list(self.connections):
+            asyncio.run_coroutine_threadsafe(connection.send(message), self.loop).result()
+
+    def drop(self):
+        self.subscribed.clear()
+        for connection in list(self.connections):
+            asyncio.run_coroutine_threadsafe(connection.close(), self.loop).result()
+
+
+@pytest.fixture
+def chain():
+    w3 = Web3(EthereumTesterProvider())
+    address = deploy_emitter(w3)
+    return w3, w3.eth.contract(address=address, abi=DEPOSIT_ABI).events.Deposit
+
+
+@pytest.fixture
+def stream_for(chain):
+    streams = []
+
+    def start(**kwargs):
+        w3, event = chain
+        stream = LogStream(event, from_block=w3.eth.block_number + 1, poll_interval=0.05,
+                           reconnect_delay=0.1, **kwargs)
+        stream.start()
+        streams.append(stream)
+        return stream
+
+    yield start
+    for stream in streams:
+        stream.stop()
+
+
+def received(stream, count, timeout=5):
+    """
+        Transaction hashes of the next `count` events, duplicates included
+    """
+    hashes = []
+    deadline = time.monotonic() + timeout
+    while len(hashes) < count:
+        hashes.append(bytes(stream.events.get(timeout=max(0.01, deadline - time.monotonic())).transactionHash))
+    return hashes
+
+
+def test_polls_without_a_websocket(chain, stream_for):
+    w3, event = chain
+    stream = stream_for()
+    logs = [emit(w3, event.address) for _ in range(3)]
+    assert received(stream, 3) == [bytes(log['transactionHash']) for log in logs]
+    assert stream.mode == 'polling'
+
+
+def test_reconnects_without_losing_logs_emitted_while_down(chain, stream_for):
+    w3, event = chain
+    node = WebSocketNode()
+    stream = stream_for(ws_url=node.url)
+    assert node.subscribed.wait(5)
+
+    live = emit(w3, event.address)
+    node.push(raw_log(live))
+    assert received(stream, 1) == [bytes(live['transactionHash'])]
+
+    # Logs emitted while the connection is down are backfilled over HTTP
+    node.drop()
+    missed = [emit(w3, event.address) for _ in range(2)]
+    assert node.subscribed.wait(5)
+    deadline = time.monotonic() + 5
+    hashes = set()
+    while not {bytes(log['transactionHash']) for log in missed} <= hashes and time.monotonic() < deadline:
+        try:
+            hashes.add(bytes(stream.events.get(timeout=0.1).transactionHash))
+        except queue.Empty:
+            pass
+    assert {bytes(log['transactionHash']) for log in missed} <= hashes
+    assert stream.reconnects >= 1
@@ -0,0 +1,224 @@
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import relay_lanes
+from relay_lanes import OrderedSubmitter, RelayEngine, RelayJob
+from tx_watchdog import TxWatchdog
+
+
+class FakeEth:
+    """
+        A node that only takes the account's next nonce, like a real one
+        without queued transactions
+    """
+
+    def __init__(self, nonce=0):
+        self.nonce = nonce
+        self.sent = []
+        self.fail = set()
+        self.chain_id = 1
+        self.gas_price = 10
+        self.block_number = 1
+        self.lock = threading.Lock()
+
+    def get_transaction_count(self, address, block_identifier):
+        return self.nonce
+
+    def fee_history(self, blocks, newest, percentiles):
+        return {'baseFeePerGas': [], 'reward': []}
+
+    def get_block(self, block_id):
+        return {}
+
+    def send_raw_transaction(self, tx):
+        with self.lock:
+            if tx.get('data') in self.fail:
+                self.fail.discard(tx.get('data'))
+                raise ValueError("connection reset")
+            if tx['nonce'] < self.nonce:
+                raise ValueError("nonce too low")
+            if tx['nonce'] > self.nonce:
+                raise ValueError("nonce too high")
+            self.sent.append(tx)
+            self.nonce += 1
+            return tx_hash(tx)
+
+
+def tx_hash(tx):
+    return hashlib.sha256(repr(sorted(tx.items())).encode()).digest()
+
+
+class FakeWeb3:
+    def __init__(self, eth):
+        self.eth = eth
+
+
+class FakeSigner:
+    address = '0x' + '11' * 20
+
+    def sign_transaction(self, tx):
+        return SimpleNamespace(raw_transaction=dict(tx), hash=tx_hash(tx))
+
+
+class Collector:
+    def __init__(self):
+        self.jobs = []
+        self.called = threading.Event()
+
+    def __call__(self, job):
+        self.jobs.append(job)
+        self.called.set()
+
+
+def make_job(name):
+    return RelayJob(None, 'wrap', (name,), None, 'lane')
+
+
+def submit(submitter, job, nonce=None):
+    job.nonce = submitter.next_nonce() if nonce is None else nonce
+    job.tx = {'nonce': job.nonce, 'data': job.args[0], 'gasPrice': 10}
+    submitter.submit(job.nonce, FakeSigner().sign_transaction(job.tx), job)
+
+
+@pytest.fixture
+def node():
+    return FakeEth()
+
+
+@pytest.fixture
+def start_submitter(node):
+    submitters = []
+
+    def start(on_failed=None, on_sent=None, watchdog=None):
+        submitter = OrderedSubmitter(FakeWeb3(node), FakeSigner(), watchdog, on_sent, on_failed)
+        submitter.start()
+        submitters.append(submitter)
+        return submitter
+
+    yield start
+    for submitter in submitters:
+        submitter.stop()
+
+
+def test_broadcasts_in_nonce_order(node, start_submitter):
+    submitter = start_submitter()
+    jobs = [make_job(name) for name in 'abc']
+    for job in jobs:
+        job.nonce = submitter.next_nonce()
+    for job in reversed(jobs):
+        submit(submitter, job, job.nonce)
+    for job in jobs:
+        assert job.done.wait(5)
+    assert [tx['data'] for tx in node.sent] == ['a', 'b', 'c']
+    assert all(job.error is None for job in jobs)
+
+
+def test_resyncs_when_the_account_was_used_elsewhere(node, start_submitter):
+    failed = Collector()
+    submitter = start_submitter(on_failed=failed)
+    # Another process sends two transactions from the same account
+    node.nonce = 2
+
+    job = make_job('a')
+    submit(submitter, job)
+    assert failed.called.wait(5)
+    assert failed.jobs == [job]
+    assert node.sent == []
+
+    # The next nonce handed out is the node's
+    retried = make_job('a')
+    submit(submitter, retried)
+    assert retried.done.wait(5)
+    assert retried.nonce == 2
+    assert [tx['nonce'] for tx in node.sent] == [2]
+
+
+def test_nonce_handed_out_before_a_resync_is_given_back(node, start_submitter):
+    failed = Collector()
+    submitter = start_submitter(on_failed=failed)
+    late = make_job('late')
+    late.nonce = submitter.next_nonce()
+    node.nonce = 3
+    submitter.resync()
+
+    submit(submitter, late, late.nonce)
+    assert failed.jobs == [late]
+    assert node.sent == []
+
+
+def test_failed_send_is_filled_and_handed_back(node, start_submitter):
+    failed = Collector()
+    submitter = start_submitter(on_failed=failed)
+    node.fail.add('a')
+    first, second = make_job('a'), make_job('b')
+    submit(submitter, first)
+    submit(submitter, second)
+
+    assert second.done.wait(5)
+    assert failed.called.wait(5)
+    assert failed.jobs == [first]
+    assert not first.done.is_set()
+    # A no-op filler took the failed relay's nonce, so the next one still went out
+    assert [(tx['nonce'], tx.get('data')) for tx in node.sent] == [(0, None), (1, 'b')]
+    # priced to replace the relay in case the node took it after all
+    assert node.sent[0]['gasPrice'] > first.tx['gasPrice']
+
+
+def test_engine_gives_up_after_max_attempts():
+    failed = Collector()
+    engine = RelayEngine(FakeSigner(), on_failed=failed)
+    job = make_job('a')
+    job.attempts = relay_lanes.MAX_ATTEMPTS - 1
+    job.error = ValueError("connection reset")
+    engine.retry(job)
+    assert job.done.is_set()
+    assert failed.jobs == [job]
+    engine.close()
+
+
+def test_relays_the_node_lost_are_sent_again_not_filled(node, start_submitter):
+    watchdog = TxWatchdog()
+    submitter = start_submitter(watchdog=watchdog)
+    sent = [make_job(name) for name in 'ab']
+    for job in sent:
+        submit(submitter, job)
+        assert job.done.wait(5)
+    # The node forgets both (evicted, or a failover to a node that never saw them)
+    node.nonce = 0
+    node.sent = []
+
+    job = make_job('c')
+    submit(submitter, job)
+    assert job.done.wait(5)
+    assert [(tx['nonce'], tx.get('data')) for tx in node.sent] == [(0, 'a'), (1, 'b'), (2, 'c')]
+
+
+def test_relay_is_watched_when_even_the_filler_is_refused(node, start_submitter):
+    watchdog = TxWatchdog()
+    failed, sent = Collector(), Collector()
+    submitter = start_submitter(on_failed=failed, on_sent=sent, watchdog=watchdog)
+    # The relay errors out (maybe after the node took it), then the filler is refused
+    node.fail.update({'a', None})
+    job = make_job('a')
+    submit(submitter, job)
+
+    assert job.done.wait(5)
+    assert sent.jobs == [job] and failed.jobs == []
+    tracked = watchdog.find(submitter.w3, FakeSigner.address, job.nonce)
+    assert tracked.job is job
+    assert tracked.tx_hash == FakeSigner().sign_transaction(job.tx).hash
+
+
+def test_engine_retries_relays_the_watchdog_dropped():
+    engine = RelayEngine(FakeSigner())
+    retried = []
+    engine.retry = retried.append
+    job = make_job('a')
+    tracked = SimpleNamespace(job=job, nonce=0)
+    assert engine.retry_dropped(tracked)
+    assert retried == [job] and 'Nonce 0' in str(job.error)
+    assert not engine.retry_dropped(SimpleNamespace(job=None, nonce=1))
+    engine.close()
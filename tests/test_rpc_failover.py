@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from web3 import Web3
+
+from rpc_failover import FailoverProvider
+
+
+class StubNode:
+    """
+        A JSON-RPC endpoint on localhost that answers every read with its own
+        block number (so tests can tell which endpoint answered), after `delay`
+        seconds, or with a 503 while `down` is set
+    """
+
+    def __init__(self, block, delay=0.0):
+        self.block = block
+        self.delay = delay
+        self.down = False
+        self.methods = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.methods.append(request['method'])
+                time.sleep(stub.delay)
+                if stub.down:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if request['method'] == 'eth_sendRawTransaction':
+                    result = '0x' + '11' * 32
+                elif request['method'] == 'eth_newFilter':
+                    result = hex(1000 + stub.block)
+                else:
+                    result = hex(stub.block)
+                body = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(*delays):
+        for delay in delays:
+            started.append(StubNode(len(started) + 1, delay))
+        return started
+
+    yield start
+    for node in started:
+        node.close()
+
+
+def test_reads_go_to_the_fastest_endpoint(nodes):
+    slow, fast = nodes(0.05, 0.0)
+    provider = FailoverProvider([slow.url, fast.url], hedge=False)
+    w3 = Web3(provider)
+    # Both get measured once, then the fast one takes everything
+    answers = [w3.eth.block_number for _ in range(10)]
+    assert answers[2:] == [fast.block] * 8
+    assert provider.ranked()[0].url == fast.url
+
+
+def test_fails_over_and_cools_down_a_broken_endpoint(nodes):
+    broken, working = nodes(0.0, 0.02)
+    broken.down = True
+    provider = FailoverProvider([broken.url, working.url], hedge=False, max_failures=2)
+    w3 = Web3(provider)
+    assert [w3.eth.block_number for _ in range(5)] == [working.block] * 5
+    # Once it has failed max_failures times in a row it isn't tried any more
+    assert broken.methods.count('eth_blockNumber') == 2
+    assert not provider.endpoints[0].healthy()
+    assert provider.ranked()[-1].url == broken.url
+
+
+def test_slow_read_is_hedged_to_the_next_endpoint(nodes):
+    primary, backup = nodes(0.0, 0.05)
+    provider = FailoverProvider([primary.url, backup.url])
+    w3 = Web3(provider)
+    # Enough answers for the primary to have a p95
+    for _ in range(30):
+        w3.eth.block_number
+    assert provider.endpoints[0].p95() is not None
+
+    hedged = provider.hedged
+    primary.delay = 1.0
+    start = time.perf_counter()
+    assert w3.eth.block_number == backup.block
+    assert time.perf_counter() - start < 0.8
+    assert provider.hedged == hedged + 1
+
+
+def test_raw_transactions_are_broadcast_to_every_endpoint(nodes):
+    endpoints = nodes(0.0, 0.01, 0.02)
+    provider = FailoverProvider([node.url for node in endpoints])
+    w3 = Web3(provider)
+    assert w3.eth.send_raw_transaction(b'\x01\x02') == bytes.fromhex('11' * 32)
+    # The first answer is returned, the rest still arrive
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline and not all('eth_sendRawTransaction' in node.methods for node in endpoints):
+        time.sleep(0.01)
+    assert all(node.methods.count('eth_sendRawTransaction') == 1 for node in endpoints)
+
+
+def test_filter_calls_go_back_to_the_endpoint_that_made_the_filter(nodes):
+    first, second = nodes(0.0, 0.0)
+    provider = FailoverProvider([first.url, second.url], hedge=False)
+    filter_id = provider.make_request('eth_newFilter', [{}])['result']
+    owner = first if filter_id == hex(1000 + first.block) else second
+    for _ in range(5):
+        provider.make_request('eth_getFilterChanges', [filter_id])
+    assert owner.methods.count('eth_getFilterChanges') == 5
@@ -0,0 +1,209 @@
+import math
+import threading
+import time
+
+from web3.exceptions import TransactionNotFound
+
+from fee_oracle import get_fee_oracle
+from head_tracker import block_number
+from structured_logging import get_logger
+
+
+log = get_logger('tx_watchdog')
+
+
+def event_id(event):
+    """
+        Identifies the bridge event a relay transaction was sent for
+    """
+    return f"{event.transactionHash.hex()}:{event.logIndex}"
+
+
+class TrackedTx:
+    """
+        A relay transaction being watched by TxWatchdog
+        hashes holds every version that was broadcast for this nonce,
+        final_hash/receipt are set once one of them is mined, dropped is set
+        instead if the nonce got used by some other transaction
+        job is whatever the sender wants back with it (e.g. the RelayJob, to retry it)
+    """
+
+    def __init__(self, w3, signer, tx, tx_hash, event_id, sent_block, job=None):
+        self.w3 = w3
+        self.signer = signer
+        self.tx = dict(tx)
+        self.nonce = tx['nonce']
+        self.event_id = event_id
+        self.hashes = [tx_hash]
+        self.sent_block = sent_block
+        self.bumps = 0
+        self.final_hash = None
+        self.receipt = None
+        self.dropped = False
+        self.job = job
+        self.done = threading.Event()
+
+    @property
+    def tx_hash(self):
+        return self.hashes[-1]
+
+
+def bump_fees(tx, fees, bump):
+    """
+        Returns the fee fields for a replacement of tx
+        Nodes only accept a replacement for the same nonce if every fee field
+        is raised by at least 10%, so each field is the larger of the old value
+        times `bump` and the current market fee in `fees`
+    """
+    if 'gasPrice' in tx:
+        keys = ['gasPrice']
+    else:
+        keys = ['maxFeePerGas', 'maxPriorityFeePerGas']
+    bumped = {key: max(math.ceil(tx[key] * bump), fees.get(key, 0)) for key in keys}
+    if 'maxFeePerGas' in bumped:
+        bumped['maxFeePerGas'] = max(bumped['maxFeePerGas'], bumped['maxPriorityFeePerGas'])
+    return bumped
+
+
+class TxWatchdog(threading.Thread):
+    """
+        Background thread that follows every relay transaction by nonce
+        If a transaction hasn't been mined `stuck_blocks` blocks after it was sent,
+        it is re-signed with the same nonce and bumped fees (at most `max_bumps` times)
+        The hash that finally got mined is recorded against the original event in `results`
+        Transactions whose nonce was mined by another transaction (dropped by the
+        node and the nonce reused, or replaced by a filler) stop being watched,
+        on_dropped is called with them
+    """
+
+    def __init__(self, stuck_blocks=3, poll_interval=2, bump=1.125, max_bumps=5, on_final=None, on_dropped=None):
+        super().__init__(daemon=True)
+        self.stuck_blocks = stuck_blocks
+        self.poll_interval = poll_interval
+        self.bump = bump
+        self.max_bumps = max_bumps
+        self.on_final = on_final
+        self.on_dropped = on_dropped
+        self.results = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def track(self, w3, signer, tx, tx_hash, event_id=None, job=None):
+        """
+            Start watching a transaction that was just broadcast
+            tx is the unsigned transaction dict (it must include nonce and fee fields)
+        """
+        tracked = TrackedTx(w3, signer, tx, tx_hash, event_id, block_number(w3), job)
+        with self._lock:
+            self._pending.append(tracked)
+        return tracked
+
+    def wait(self, tracked, timeout=None):
+        """
+            Blocks until the transaction (or one of its replacements) is mined
+            Returns the receipt, or None on timeout or if it was dropped
+        """
+        tracked.done.wait(timeout)
+        return tracked.receipt
+
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+    def find(self, w3, address, nonce):
+        """
+            The pending transaction sent from address with nonce on w3, or None
+        """
+        with self._lock:
+            for tracked in self._pending:
+                if tracked.w3 is w3 and tracked.nonce == nonce and tracked.signer.address == address:
+                    return tracked
+        return None
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.check()
+            self._stopped.wait(self.poll_interval)
+
+    def check(self):
+        """
+            One pass over the pending transactions: record the mined ones, drop
+            the ones whose nonce went to another transaction and replace the
+            ones that have been stuck for too long
+        """
+        block_numbers = {}
+        mined_nonces = {}
+        for tracked in self.pending():
+            try:
+                if self._find_receipt(tracked):
+                    continue
+                if self._nonce_taken(tracked, mined_nonces):
+                    self._drop(tracked)
+                    continue
+                w3 = tracked.w3
+                if id(w3) not in block_numbers:
+                    block_numbers[id(w3)] = block_number(w3)
+                if block_numbers[id(w3)] - tracked.sent_block >= self.stuck_blocks and tracked.bumps < self.max_bumps:
+                    self._replace(tracked, block_numbers[id(w3)])
+            except Exception as e:
+                log.error("Watchdog failed to check transaction", extra={'nonce': tracked.nonce, 'error': str(e)})
+
+    def _find_receipt(self, tracked):
+        # Any version of the transaction may be the one that got mined
+        for tx_hash in reversed(tracked.hashes):
+            try:
+                receipt = tracked.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+            tracked.final_hash = tx_hash
+            tracked.receipt = receipt
+            with self._lock:
+                self._pending.remove(tracked)
+                # A batched relay covers several events
+                event_ids = tracked.event_id if isinstance(tracked.event_id, list) else [tracked.event_id]
+                for relayed_event_id in event_ids:
+                    if relayed_event_id is not None:
+                        self.results[relayed_event_id] = tx_hash
+            tracked.done.set()
+            if self.on_final:
+                self.on_final(tracked)
+            return True
+        return False
+
+    def _nonce_taken(self, tracked, mined_nonces):
+        key = (id(tracked.w3), tracked.signer.address)
+        if key not in mined_nonces:
+            mined_nonces[key] = tracked.w3.eth.get_transaction_count(tracked.signer.address, 'latest')
+        if mined_nonces[key] <= tracked.nonce:
+            return False
+        # The count was read first, so if one of our versions was mined it has a receipt by now
+        return not self._find_receipt(tracked)
+
+    def _drop(self, tracked):
+        with self._lock:
+            self._pending.remove(tracked)
+        tracked.dropped = True
+        tracked.done.set()
+        log.warning("Nonce was mined by another transaction, dropped", extra={'nonce': tracked.nonce, 'tx_hash': tracked.tx_hash})
+        if self.on_dropped:
+            self.on_dropped(tracked)
+
+    def _replace(self, tracked, current_block):
+        oracle = get_fee_oracle(tracked.w3)
+        oracle.invalidate()
+        tracked.tx.update(bump_fees(tracked.tx, oracle.fee_fields(), self.bump))
+        signed_txn = tracked.signer.sign_transaction(tracked.tx)
+        try:
+            tx_hash = tracked.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        except Exception as e:
+            # "nonce too low" means an earlier version was just mined, the next check will find it
+            log.warning("Watchdog failed to replace transaction", extra={'nonce': tracked.nonce, 'error': str(e)})
+            return
+        tracked.hashes.append(tx_hash)
+        tracked.bumps += 1
+        tracked.sent_block = current_block
+        log.info("Replaced stuck transaction", extra={'nonce': tracked.nonce, 'tx_hash': tx_hash, 'bumps': tracked.bumps})